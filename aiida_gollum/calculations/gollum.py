@@ -1,21 +1,79 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import os
+import time
+from collections import namedtuple, OrderedDict
+
+import numpy as np
 
 from aiida.common.constants import elements
 from aiida.common.datastructures import CalcInfo, CodeInfo
 from aiida.common.exceptions import InputValidationError
 from aiida.common.utils import classproperty
 from aiida.orm.calculation.job import JobCalculation
+from aiida.orm.data.array import ArrayData
 from aiida.orm.data.array.kpoints import KpointsData
 from aiida.orm.data.parameter import ParameterData
 from aiida.orm.data.remote import RemoteData
 from aiida.orm.data.singlefile import SinglefileData
 
+from aiida_gollum.parsers.gdat import COMPRESSION_SUFFIXES
+from aiida_gollum.utils.remote_cache import (get_cache_folder,
+                                             get_cached_copy_lists)
+
 __copyright__ = u"Copyright (c), 2015, ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE (Theory and Simulation of Materials (THEOS) and National Centre for Computational Design and Discovery of Novel Materials (NCCR MARVEL)), Switzerland and ROBERT BOSCH LLC, USA. All rights reserved."
 __license__ = "MIT license, see LICENSE.txt file"
 __version__ = "0.12.0"
 __contributors__ = "Victor M. Garcia-Suarez"
 
+# Description of an output data file of Gollum: the file name, the name
+# of the link of the parsed node, the prefix of its summary values in
+# the output parameters and the kind of file, which selects the parsing
+# function of the GollumParser
+GollumOutput = namedtuple('GollumOutput',
+                          ['filename', 'linkname', 'prefix', 'filetype'])
+
+# Registry of the output data files retrieved and parsed by the plugin.
+# The order is the order in which they are parsed and linked
+GOLLUM_OUTPUTS = (
+    GollumOutput('Open_channels_per_spin1.gdat', 'oc_array', 'oc', 'gdat'),
+    GollumOutput('Open_channels_up1.gdat', 'ou_array', 'ou', 'gdat'),
+    GollumOutput('Open_channels_down1.gdat', 'od_array', 'od', 'gdat'),
+    GollumOutput('T_per_spin2.gdat', 'tt_array', 'tt', 'gdat'),
+    GollumOutput('T_up2.gdat', 'tu_array', 'tu', 'gdat'),
+    GollumOutput('T_down2.gdat', 'td_array', 'td', 'gdat'),
+)
+
+# Prefixes of the output data files that are only produced by
+# spin-polarized calculations
+SPIN_OUTPUT_PREFIXES = ('ou', 'od', 'tu', 'td')
+
+# Commands of the compression of the output data files before the
+# retrieval, and smallest size (in bytes) of the files that are
+# compressed
+COMPRESSION_COMMANDS = {'gzip': 'gzip -f', 'xz': 'xz -f -T0'}
+COMPRESSION_MIN_SIZE = 1024 * 1024
+
+# Script of the remote reduction of the output data files, and default
+# number of points of the reduced curves
+REDUCER_SCRIPT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'utils',
+    'gollum_reducer.py')
+REDUCTION_POINTS = 2000
+
+# Bounds of the cache of rendered input blocks of write_cached_input_data:
+# number of blocks and total number of characters
+INPUT_CACHE_SIZE = 512
+INPUT_CACHE_CHARS = 64 * 1024 * 1024
+
+# Values shorter than this are rendered directly, since it is cheaper
+# than hashing them
+_MIN_CACHED_LENGTH = 256
+
+# Rendered blocks by (key, hash of the value), least recently used first
+_input_cache = OrderedDict()
+_input_cache_chars = [0]
+
 class GollumCalculation(JobCalculation):
     """
     Plugin for the Gollum program which computes the electronic transport
@@ -33,12 +91,6 @@ class GollumCalculation(JobCalculation):
         self._DEFAULT_INPUT_FILE = 'input'
         self._DEFAULT_OUTPUT_FILE = 'aiida.out'
         self._DEFAULT_MESSAGES_FILE = 'aiida.out'
-        self._DEFAULT_OC_FILE = 'Open_channels_per_spin1.gdat'
-        self._DEFAULT_OU_FILE = 'Open_channels_up1.gdat'
-        self._DEFAULT_OD_FILE = 'Open_channels_down1.gdat'
-        self._DEFAULT_TT_FILE = 'T_per_spin2.gdat'
-        self._DEFAULT_TU_FILE = 'T_up2.gdat'
-        self._DEFAULT_TD_FILE = 'T_down2.gdat'
 
         self._GFILES_SUBFOLDER = './'
         self._OUTPUT_SUBFOLDER = './'
@@ -46,12 +98,14 @@ class GollumCalculation(JobCalculation):
         self._INPUT_FILE_NAME = 'input'
         self._OUTPUT_FILE_NAME = 'aiida.out'
         self._MESSAGES_FILE_NAME = 'aiida.out'
-        self._OC_FILE_NAME = 'Open_channels_per_spin1.gdat'
-        self._OU_FILE_NAME = 'Open_channels_up1.gdat'
-        self._OD_FILE_NAME = 'Open_channels_down1.gdat'
-        self._TT_FILE_NAME = 'T_per_spin2.gdat'
-        self._TU_FILE_NAME = 'T_up2.gdat'
-        self._TD_FILE_NAME = 'T_down2.gdat'
+
+        # Output data files retrieved and parsed. Their names are only
+        # defined in the GOLLUM_OUTPUTS registry
+        self._GOLLUM_OUTPUTS = GOLLUM_OUTPUTS
+
+        # Script and summary of the remote reduction of the output data
+        self._REDUCER_FILE_NAME = 'gollum_reducer.py'
+        self._SUMMARY_FILE_NAME = 'gollum_summary.npz'
 
         # in restarts, it will copy from the parent the following
         self._restart_copy_from = os.path.join(self._OUTPUT_SUBFOLDER, 'partial.mat')
@@ -59,6 +113,11 @@ class GollumCalculation(JobCalculation):
         # in restarts, it will copy the previous folder in the following one
         self._restart_copy_to = self._OUTPUT_SUBFOLDER
 
+        # Files of the named parent folders (Siesta calculations of the
+        # leads and the extended molecule) linked in their subfolders
+        self._PARENT_REMOTE_FILES = ['aiida.out', 'aiida.HSX', 'aiida.DM',
+                                     'aiida.ORB_INDX', 'aiida.XV']
+
     @classproperty
     def _use_methods(cls):
         """
@@ -92,8 +151,39 @@ class GollumCalculation(JobCalculation):
             'linkname': 'singlefile',
             'docstring': ("Some file that is needed to run the calculation"),
         }
+        retdict['block'] = {
+            'valid_types': ArrayData,
+            'additional_parameter': 'block_name',
+            'linkname': cls._get_linkname_block,
+            'docstring': ("Use an ArrayData with the values of the "
+                          "numerical block 'NBlock <block_name>'"),
+        }
+        retdict['parent_remote'] = {
+            'valid_types': RemoteData,
+            'additional_parameter': 'name',
+            'linkname': cls._get_linkname_parent_remote,
+            'docstring': ("Use the remote folder of a previous calculation "
+                          "(e.g. the leads or the extended molecule), "
+                          "whose files are linked in the subfolder <name>"),
+        }
         return retdict
 
+    @classmethod
+    def _get_linkname_block(cls, block_name):
+        """
+        The name of the link used for the ArrayData of the numerical
+        block 'NBlock <block_name>'.
+        """
+        return 'block_{}'.format(block_name)
+
+    @classmethod
+    def _get_linkname_parent_remote(cls, name):
+        """
+        The name of the link used for the named parent remote folder,
+        whose files are linked in the subfolder './<name>/'.
+        """
+        return 'parent_remote_{}'.format(name)
+
     def _prepare_for_submission(self, tempfolder, inputdict):
         """
         This is the routine to be called when you want to create
@@ -104,6 +194,7 @@ class GollumCalculation(JobCalculation):
         :param inputdict: a dictionary with the input nodes, as they would
                 be returned by get_inputdata_dict (without the Code!)
         """
+        profile = _SubmissionProfile()
 
         local_copy_list = []
         remote_copy_list = []
@@ -149,6 +240,30 @@ class GollumCalculation(JobCalculation):
                 raise InputValidationError("parent_calc_folder, if specified,"
                                            "must be of type RemoteData")
 
+        # Numerical blocks given as ArrayData
+        array_blocks = {}
+        block_prefix = self._get_linkname_block('')
+        for linkname in [l for l in inputdict if l.startswith(block_prefix)]:
+            block_key = 'NBlock ' + linkname[len(block_prefix):]
+            array_blocks[block_key] = _get_block_array(
+                inputdict.pop(linkname), block_key)
+
+        # Named parent remote folders
+        parent_remotes = {}
+        parent_prefix = self._get_linkname_parent_remote('')
+        for linkname in [l for l in inputdict if l.startswith(parent_prefix)]:
+            name = linkname[len(parent_prefix):]
+            parent_remote = inputdict.pop(linkname)
+            if not isinstance(parent_remote, RemoteData):
+                raise InputValidationError("The parent remote folder '{}' "
+                                           "must be of type RemoteData"
+                                           "".format(name))
+            if not name or name != os.path.basename(name):
+                raise InputValidationError("The name of a parent remote "
+                                           "folder must be a valid folder "
+                                           "name, not '{}'".format(name))
+            parent_remotes[name] = parent_remote
+
         # Code
         try:
             code = inputdict.pop(self.get_linkname('code'))
@@ -168,6 +283,20 @@ class GollumCalculation(JobCalculation):
 
         input_params = parameters.get_dict()
 
+        # Check the atom block against the extended molecule, if given
+        expected_atoms = settings_dict.pop('EXPECTED_ATOMS', None)
+        if expected_atoms is not None and 'atom' in input_params:
+            validate_atom_block(input_params['atom'], int(expected_atoms))
+
+        for block_key in array_blocks:
+            if block_key in input_params:
+                raise InputValidationError(
+                    "The block '{}' is defined both in the parameters and "
+                    "as an ArrayData input".format(block_key))
+
+        store_profile = settings_dict.pop('PROFILE_SUBMISSION', False)
+        profile.lap('check_inputs')
+
         # = Preparation of input data ============================
 
         input_filename = tempfolder.get_abs_path(self._INPUT_FILE_NAME)
@@ -175,8 +304,10 @@ class GollumCalculation(JobCalculation):
         with open(input_filename, 'w') as infile:
             # Here print keys and values to file
 
-            for k, v in sorted(input_params.iteritems()):
-                infile.write(get_input_data_text(k, v))
+            for k, v in sorted(input_params.items() + array_blocks.items()):
+                write_cached_input_data(infile, k, v)
+
+        profile.lap('input_file')
 
         # = Additional files =====================================
 
@@ -198,6 +329,53 @@ class GollumCalculation(JobCalculation):
                 lf='./'+lfile[len(lfile)-1]
                 local_copy_list.append((unicode(k),unicode(lf)))
 
+        # Files already on the computer of the calculation (e.g. shared
+        # by all the calculations of a GollumBatch), given by their
+        # absolute remote paths and linked in the working directory
+        remote_symlink_list = []
+        settings_remote_symlink_list = settings_dict.pop(
+                'ADDITIONAL_REMOTE_SYMLINK_LIST', [])
+        for k in settings_remote_symlink_list:
+            if not os.path.isabs(k):
+                raise InputValidationError(
+                    "The paths of the additional remote symlink list must "
+                    "be absolute, not '{}'".format(k))
+            remote_symlink_list.append(
+                (self.get_computer().uuid, unicode(k),
+                 unicode('./' + os.path.basename(k))))
+
+        # Files of the named parent folders, linked in './<name>/'. The
+        # parents must be on the computer of the calculation
+        parent_remote_files = settings_dict.pop('PARENT_REMOTE_FILES',
+                                                self._PARENT_REMOTE_FILES)
+        for name, parent_remote in sorted(parent_remotes.items()):
+            if parent_remote.get_computer().uuid != self.get_computer().uuid:
+                raise InputValidationError(
+                    "The parent remote folder '{}' is not on the computer "
+                    "of the calculation".format(name))
+            tempfolder.get_subfolder(name, create=True)
+            for filename in parent_remote_files:
+                remote_symlink_list.append(
+                    (parent_remote.get_computer().uuid,
+                     os.path.join(parent_remote.get_remote_path(), filename),
+                     os.path.join(name, filename)))
+
+        profile.lap('local_copies')
+        if store_profile:
+            profile.add_bytes('local_copy_bytes', local_copy_list)
+
+        # Local copies are linked from the remote cache of the computer
+        # instead of uploaded, if they were seeded in the cache (the
+        # index of the cache is checked, not the computer itself)
+        use_remote_cache = settings_dict.pop('REMOTE_CACHE', True)
+        if (use_remote_cache and local_copy_list and
+                get_cache_folder(self.get_computer()) is not None):
+            local_copy_list, cache_symlink_list = (
+                get_cached_copy_lists(self.get_computer(), local_copy_list))
+            remote_symlink_list += cache_symlink_list
+
+        profile.lap('remote_cache')
+
         # = Parent calculation folder ============================
 
         # The presence of a 'parent_calc_folder' input node signals
@@ -222,18 +400,15 @@ class GollumCalculation(JobCalculation):
 
         if cmdline_params:
             calcinfo.cmdline_params = list(cmdline_params)
-        calcinfo.local_copy_list = local_copy_list
+        # A copy, since the reducer script may be added to it, and
+        # local_copy_list is measured by the submission profile
+        calcinfo.local_copy_list = list(local_copy_list)
         calcinfo.remote_copy_list = remote_copy_list
+        calcinfo.remote_symlink_list = remote_symlink_list
 
         calcinfo.stdin_name = self._INPUT_FILE_NAME
         calcinfo.stdout_name = self._OUTPUT_FILE_NAME
         calcinfo.messages_name = self._MESSAGES_FILE_NAME
-        calcinfo.oc_name = self._OC_FILE_NAME
-        calcinfo.ou_name = self._OU_FILE_NAME
-        calcinfo.od_name = self._OD_FILE_NAME
-        calcinfo.tt_name = self._TT_FILE_NAME
-        calcinfo.tu_name = self._TU_FILE_NAME
-        calcinfo.td_name = self._TD_FILE_NAME
 
         # = Code information object ==============================
 
@@ -243,32 +418,72 @@ class GollumCalculation(JobCalculation):
         #codeinfo.stdin_name = self._INPUT_FILE_NAME
         codeinfo.stdout_name = self._OUTPUT_FILE_NAME
         codeinfo.messages_name = self._MESSAGES_FILE_NAME
-        codeinfo.oc_name = self._OC_FILE_NAME
-        codeinfo.ou_name = self._OU_FILE_NAME
-        codeinfo.od_name = self._OD_FILE_NAME
-        codeinfo.tt_name = self._TT_FILE_NAME
-        codeinfo.tu_name = self._TU_FILE_NAME
-        codeinfo.td_name = self._TD_FILE_NAME
         codeinfo.code_uuid = code.uuid
         calcinfo.codes_info = [codeinfo]
 
         # = Retrieve files =======================================
 
-        # Retrieve by default: the output file
-        calcinfo.retrieve_list = []
-        calcinfo.retrieve_list.append(self._OUTPUT_FILE_NAME)
-        calcinfo.retrieve_list.append(self._MESSAGES_FILE_NAME)
-        calcinfo.retrieve_list.append(self._OC_FILE_NAME)
-        calcinfo.retrieve_list.append(self._OU_FILE_NAME)
-        calcinfo.retrieve_list.append(self._OD_FILE_NAME)
-        calcinfo.retrieve_list.append(self._TT_FILE_NAME)
-        calcinfo.retrieve_list.append(self._TU_FILE_NAME)
-        calcinfo.retrieve_list.append(self._TD_FILE_NAME)
+        # Retrieve by default: the output file and the output data files
+        # (only the total ones if the calculation is not spin-polarized)
+        retrieve_policy = settings_dict.pop('RETRIEVE_POLICY', {})
+        spin_polarized = retrieve_policy.get('spin_polarized', True)
+        output_filenames = [output.filename
+                            for output in self._GOLLUM_OUTPUTS
+                            if spin_polarized or
+                            output.prefix not in SPIN_OUTPUT_PREFIXES]
+
+        retrieve_list = [self._OUTPUT_FILE_NAME, self._MESSAGES_FILE_NAME]
+        append_text = []
+
+        # The output data files can be reduced on the computer to a
+        # summary, which is retrieved instead of the full files
+        reduction = settings_dict.pop('REMOTE_REDUCTION', None)
+        if reduction:
+            if not isinstance(reduction, dict):
+                reduction = {}
+            calcinfo.local_copy_list.append(
+                (REDUCER_SCRIPT, self._REDUCER_FILE_NAME))
+            append_text.append(
+                "{python} {script} {summary} {points} {files}".format(
+                    python=reduction.get('python', 'python'),
+                    script=self._REDUCER_FILE_NAME,
+                    summary=self._SUMMARY_FILE_NAME,
+                    points=int(reduction.get('points',
+                                             REDUCTION_POINTS)),
+                    files=' '.join(
+                        '{}={}'.format(output.prefix, output.filename)
+                        for output in self._GOLLUM_OUTPUTS
+                        if output.filename in output_filenames)))
+            retrieve_list.append(self._SUMMARY_FILE_NAME)
+            if not reduction.get('retrieve_full', False):
+                output_filenames = []
+
+        # The large output data files can be compressed on the computer
+        # before they are retrieved; both names are retrieved, since the
+        # small files are not compressed
+        compression = retrieve_policy.get('compression', None)
+        if compression is not None and output_filenames:
+            append_text.append(_get_compression_text(
+                output_filenames, compression,
+                retrieve_policy.get('compression_min_size',
+                                    COMPRESSION_MIN_SIZE)))
+            output_filenames += [f + COMPRESSION_SUFFIXES[compression]
+                                 for f in output_filenames]
+
+        retrieve_list += output_filenames
+        if append_text:
+            calcinfo.append_text = '\n'.join(append_text)
 
         # Any other files specified in the settings dictionary
         settings_retrieve_list = settings_dict.pop('ADDITIONAL_RETRIEVE_LIST',
                                                    [])
-        calcinfo.retrieve_list += settings_retrieve_list
+        retrieve_list += settings_retrieve_list
+
+        # The output and messages files are the same
+        calcinfo.retrieve_list = []
+        for filename in retrieve_list:
+            if filename not in calcinfo.retrieve_list:
+                calcinfo.retrieve_list.append(filename)
 
         # = Copy additional remote files =========================
 
@@ -285,6 +500,20 @@ class GollumCalculation(JobCalculation):
                 [parent_calc_folder.get_computer().uuid,
                 src_relative,dest_relative])
 
+        profile.lap('calcinfo')
+
+        # Bytes of the folder and local copies uploaded by the daemon
+        if store_profile:
+            profile.add_bytes('input_file_bytes', [(input_filename, None)])
+            profile.add_bytes('upload_bytes', [
+                (tempfolder.get_abs_path(f), None)
+                for f in tempfolder.get_content_list()] +
+                calcinfo.local_copy_list)
+            profile.bytes['cached_bytes'] = (
+                profile.bytes['local_copy_bytes'] -
+                profile.add_bytes('uploaded_copy_bytes', local_copy_list))
+            profile.store(self)
+
         return calcinfo
 
     def _set_parent_remotedata(self, remotedata):
@@ -296,9 +525,9 @@ class GollumCalculation(JobCalculation):
         if not isinstance(remotedata, RemoteData):
             raise ValueError('remotedata must be a RemoteData')
 
-        # Complain if another remotedata is already found
-        input_remote = self.get_inputs(node_type=RemoteData)
-        if input_remote:
+        # Complain if another parent folder is already found (the named
+        # parent remote folders are not restart folders)
+        if self.get_linkname('parent_folder') in self.get_inputs_dict():
             raise ValidationError(
                 "Cannot set several parent calculation to a "
                 "{} calculation".format(self.__class__.__name__))
@@ -306,6 +535,75 @@ class GollumCalculation(JobCalculation):
         self.use_parent_folder(remotedata)
 
 
+def _get_compression_text(filenames, compression, min_size):
+    """
+    Returns the lines of the job script that compress the output files
+    larger than min_size bytes after the run.
+    """
+    if compression not in COMPRESSION_COMMANDS:
+        raise InputValidationError(
+            "The compression of the retrieve policy must be one of {}, not "
+            "'{}'".format(', '.join(sorted(COMPRESSION_COMMANDS)),
+                          compression))
+
+    return ("for f in {files}; do\n"
+            "  if [ -f \"$f\" ] && [ $(wc -c < \"$f\") -ge {size} ]; then\n"
+            "    {command} \"$f\"\n"
+            "  fi\n"
+            "done".format(files=' '.join(filenames), size=int(min_size),
+                          command=COMPRESSION_COMMANDS[compression]))
+
+
+class _SubmissionProfile(object):
+    """
+    Wall time (in seconds) of the phases of _prepare_for_submission and
+    size (in bytes) of the files that are uploaded, stored in the extra
+    'submission_profile' of the calculation when the setting
+    'profile_submission' is True.
+    """
+    def __init__(self):
+        self.times = OrderedDict()
+        self.bytes = OrderedDict()
+        self._last = time.time()
+
+    def lap(self, phase):
+        """
+        Records the time since the end of the previous phase.
+        """
+        now = time.time()
+        self.times[phase] = now - self._last
+        self._last = now
+
+    def add_bytes(self, name, copy_list):
+        """
+        Records and returns the total size of the local files (or
+        folders) of a list of (local path, destination) tuples.
+        """
+        total = 0
+        for path, _ in copy_list:
+            if os.path.isdir(path):
+                for root, _, files in os.walk(path):
+                    total += sum(os.path.getsize(os.path.join(root, f))
+                                 for f in files)
+            elif os.path.exists(path):
+                total += os.path.getsize(path)
+        self.bytes[name] = total
+
+        return total
+
+    def store(self, calc):
+        """
+        Stores the profile in the extras of a stored calculation.
+        """
+        if not calc.is_stored:
+            return
+
+        profile = dict(self.bytes)
+        profile['times'] = dict(self.times)
+        profile['total_time'] = sum(self.times.values())
+        calc.set_extra('submission_profile', profile)
+
+
 def get_input_data_text(key, val, mapping=None):
     """
     Given a key and a value, return a string (possibly multiline for arrays)
@@ -322,9 +620,35 @@ def get_input_data_text(key, val, mapping=None):
             ``magn(2) = 0.1``. This parameter is ignored if 'val'
             is not a dictionary.
     """
+    from StringIO import StringIO
+
+    text = StringIO()
+    write_input_data(text, key, val, mapping=mapping)
+
+    return text.getvalue()
+
+
+def write_input_data(infile, key, val, mapping=None):
+    """
+    Writes the text of a key and its value (see get_input_data_text)
+    directly to an open input file.
+
+    Blocks are split in rows only once and each row is written as it
+    is produced, so the time is linear in the size of the block.
+    Numerical blocks (``NBlock``) can also be given as NumPy arrays,
+    which are formatted in bulk.
+
+    :param infile: the open input file
+    :param key: the flag name
+    :param val: the flag value
+    :param mapping: see get_input_data_text
+    """
+    # Numerical blocks given as arrays
+    if key[:6] == 'NBlock' and isinstance(val, np.ndarray):
+        _write_array_block(infile, key.split()[1], val)
     # Check first the dictionary, because it would also match
     # hasattr(__iter__)
-    if isinstance(val, dict):
+    elif isinstance(val, dict):
         if mapping is None:
             raise ValueError("If 'val' is a dictionary, you must provide also "
                              "the 'mapping' parameter")
@@ -343,57 +667,35 @@ def get_input_data_text(key, val, mapping=None):
         # Resort to remove the index from the first column, finally to
         # join the strings
         list_of_strings = zip(*sorted(list_of_strings))[1]
-        return "".join(list_of_strings)
+        infile.write("".join(list_of_strings))
     elif hasattr(val, '__iter__'):
         # A list/array/tuple of values
-        list_of_strings = [
-            "{0}({2})  {1}\n".format(key, itemval, idx + 1)
-            for idx, itemval in enumerate(val)
-        ]
-        return "".join(list_of_strings)
+        for idx, itemval in enumerate(val):
+            infile.write("{0}({2})  {1}\n".format(key, itemval, idx + 1))
     else:
         # Numerical block
         if key[:6] == 'NBlock':
-            nrows = val.count("\n")
-            line1 = val.splitlines()[1]
-            ncolumns = len(line1.split())
-            bname = key.split()[1]
-            b1 = "# name: {0}\n# type: matrix\n# rows: {1}\n# columns: "\
-                "{2}".format(bname,nrows,ncolumns)
-            for i in range(nrows):
-                b1 += "\n {0}".format(val.splitlines()[i+1].lstrip())
-            return b1 + "\n"
+            rows = get_block_rows(key, val)
+            ncolumns = len(rows[0].split()) if rows else 0
+            infile.write("# name: {0}\n# type: matrix\n# rows: {1}\n"
+                         "# columns: {2}\n".format(key.split()[1],
+                                                   len(rows), ncolumns))
+            for row in rows:
+                infile.write(" {0}\n".format(row.lstrip()))
         # String block
         elif key[:6] == 'SBlock':
-            nrows = val.count("\n")
-            bname = key.split()[1]
-            b1 = "# name: {0}\n# type: string\n# rows: {1}"\
-                .format(bname,nrows)
-            for i in range(nrows):
-                b1 += "\n {0}".format(val.splitlines()[i+1].lstrip())
-            return b1 + "\n"
+            rows = get_block_rows(key, val)
+            infile.write("# name: {0}\n# type: string\n# rows: {1}\n"
+                         .format(key.split()[1], len(rows)))
+            for row in rows:
+                infile.write(" {0}\n".format(row.lstrip()))
         # Atomic block
         elif key == "atom":
-            nrows = val.count("\n")
-            b1='';l=0
-            for i in range(nrows):
-                line = val.splitlines()[i+1]
-                a0 = line.split()[0]
-                a1 = line.split()[1]
-                a2 = line.split()[2]
-                if int(a0) == 1:
-                    i1=int(a1);i2=0;i3=-1
-                elif int(a0) == 0:
-                    i1=0;i2=1;i3=1
-                else:
-                    i1=1;i2=int(a1)+1;i3=1
-                for k in range(i1,i2,i3):
-                    for j in range(1,int(a2)+1):
-                        l+=1
-                        b1 += " {0} {1} {2} {3} 0.00 0.00\n"\
-                            .format(l,a0,k,a0)
-            return "# name: {0}\n# type: matrix\n# rows: {1}\n# columns: 6\n"\
-                .format(key,l) + b1
+            table = expand_atom_block(val)
+            infile.write("# name: {0}\n# type: matrix\n# rows: {1}\n"
+                         "# columns: 6\n".format(key, len(table)))
+            if len(table):
+                np.savetxt(infile, table, fmt=' %d %d %d %d 0.00 0.00')
         # Scalars and strings
         else:
             try:
@@ -405,7 +707,213 @@ def get_input_data_text(key, val, mapping=None):
                 typd = 'string'
                 b1 = "# name: {0}\n# type: {1}\n# rows: 1\n {2}"\
                     .format(key,typd,val)
-            return b1 + "\n"
+            infile.write(b1 + "\n")
+
+
+def write_cached_input_data(infile, key, val):
+    """
+    Writes the text of a key and its value like write_input_data, but
+    reusing the text of large blocks (atom, ERange, leadp...) already
+    rendered in this process for the same key and value.
+
+    The rendered blocks are kept in a least recently used cache,
+    bounded by INPUT_CACHE_SIZE blocks and INPUT_CACHE_CHARS characters,
+    so the blocks shared by the calculations of a sweep are rendered
+    once per daemon process.
+
+    :param infile: the open input file
+    :param key: the flag name
+    :param val: the flag value
+    """
+    cache_key = _get_input_cache_key(key, val)
+    if cache_key is None:
+        write_input_data(infile, key, val)
+        return
+
+    text = _input_cache.pop(cache_key, None)
+    if text is None:
+        text = get_input_data_text(key, val)
+        _input_cache_chars[0] += len(text)
+        while _input_cache and (
+                len(_input_cache) >= INPUT_CACHE_SIZE or
+                _input_cache_chars[0] > INPUT_CACHE_CHARS):
+            _input_cache_chars[0] -= len(_input_cache.popitem(last=False)[1])
+    _input_cache[cache_key] = text
+
+    infile.write(text)
+
+
+def _get_input_cache_key(key, val):
+    """
+    Returns the key of a value in the cache of rendered blocks, or None
+    if it is not worth caching (scalars, short strings, dictionaries).
+    """
+    if isinstance(val, np.ndarray):
+        if val.nbytes < _MIN_CACHED_LENGTH:
+            return None
+        digest = hashlib.sha1(np.ascontiguousarray(val).view(np.uint8))
+        return (key, 'array', val.dtype.str, val.shape, digest.hexdigest())
+
+    if isinstance(val, basestring) and len(val) >= _MIN_CACHED_LENGTH:
+        if isinstance(val, unicode):
+            digest = hashlib.sha1(val.encode('utf-8'))
+        else:
+            digest = hashlib.sha1(val)
+        return (key, type(val).__name__, digest.hexdigest())
+
+    return None
+
+
+def expand_atom_block(val):
+    """
+    Expands the compact ``atom`` block of the parameters into the rows
+    of the Gollum ``atom`` matrix.
+
+    Each row of the compact block gives the lead number (0 for the
+    extended molecule), the number of principal layers and the number
+    of atoms per principal layer. The expanded matrix has a row per
+    atom with its index, the lead, the principal layer (numbered
+    towards the extended molecule in lead 1, from it in the others, and
+    0 in the extended molecule) and the lead again; the two constant
+    columns are added when it is written.
+
+    :param val: the multiline string of the ``atom`` block
+
+    Returns an integer array of shape (number of atoms, 4).
+    """
+    # Blank lines are skipped, as in adapt_atom_block
+    rows = []
+    for number, line in enumerate(val.splitlines()[1:], 1):
+        fields = line.split()
+        if not fields:
+            continue
+        try:
+            row = [int(field) for field in fields[:3]]
+        except ValueError:
+            row = []
+        if len(row) < 3:
+            raise InputValidationError(
+                "The row {} of the atom block must have 3 integers (lead, "
+                "principal layers and atoms per layer), not "
+                "'{}'".format(number, line.strip()))
+        rows.append(row)
+    compact = np.array(rows, dtype=int).reshape(-1, 3)
+    lead, nlayers, natoms = compact.T
+
+    # One entry per principal layer
+    nlayers = np.where(lead == 0, 1, nlayers)
+    layer_row = np.repeat(np.arange(len(compact)), nlayers)
+    position = np.arange(layer_row.size) - np.repeat(
+        np.cumsum(nlayers) - nlayers, nlayers)
+    layer_lead = lead[layer_row]
+    layer = np.where(layer_lead == 1, nlayers[layer_row] - position,
+                     np.where(layer_lead == 0, 0, position + 1))
+
+    # One entry per atom
+    atom_lead = np.repeat(layer_lead, natoms[layer_row])
+    atom_layer = np.repeat(layer, natoms[layer_row])
+
+    return np.column_stack([np.arange(1, atom_lead.size + 1), atom_lead,
+                            atom_layer, atom_lead])
+
+
+def validate_atom_block(val, natoms):
+    """
+    Checks that the ``atom`` block describes the expected number of
+    atoms (the atoms of the extended molecule of the Siesta run).
+
+    :param val: the multiline string of the ``atom`` block
+    :param natoms: the expected number of atoms
+    """
+    nrows = len(expand_atom_block(val))
+    if nrows != natoms:
+        raise InputValidationError(
+            "The atom block describes {} atoms but {} are expected (number "
+            "of atoms of the extended molecule)".format(nrows, natoms))
+
+
+def adapt_atom_block(val, natoms):
+    """
+    Adapts the ``atom`` block of a junction to another extended
+    molecule with the same leads, changing the number of atoms of the
+    extended molecule row (lead 0) so that the block describes natoms
+    atoms.
+
+    :param val: the multiline string of the ``atom`` block
+    :param natoms: the number of atoms of the new extended molecule
+
+    Returns the new multiline string.
+    """
+    rows = [row.split() for row in val.splitlines()[1:] if row.split()]
+    lead_atoms = sum(int(row[1]) * int(row[2]) for row in rows
+                     if int(row[0]) != 0)
+    if natoms <= lead_atoms:
+        raise InputValidationError(
+            "The extended molecule must have more than the {} atoms of "
+            "the leads, not {}".format(lead_atoms, natoms))
+
+    lines = []
+    for row in rows:
+        if int(row[0]) == 0:
+            row = row[:2] + [str(natoms - lead_atoms)] + row[3:]
+        lines.append(' ' + ' '.join(row))
+
+    return '\n' + '\n'.join(lines)
+
+
+def _get_block_array(arraydata, block_key):
+    """
+    Returns the array of a numerical block given as an ArrayData, which
+    must contain a single array (or an array named 'block').
+    """
+    if not isinstance(arraydata, ArrayData):
+        raise InputValidationError("The block '{}' must be of type "
+                                   "ArrayData".format(block_key))
+
+    arraynames = arraydata.get_arraynames()
+    if 'block' in arraynames:
+        return arraydata.get_array('block')
+    if len(arraynames) != 1:
+        raise InputValidationError(
+            "The ArrayData of the block '{}' must contain a single array "
+            "or an array named 'block'".format(block_key))
+
+    return arraydata.get_array(arraynames[0])
+
+
+def get_block_rows(key, val):
+    """
+    Returns the rows of a numerical or string block given as a
+    multiline string. The rows start after the first newline, e.g.
+    '\\n -8.0 8.0 1000 '.
+
+    :param key: the name of the block, e.g. 'NBlock ERange'
+    :param val: the multiline string of the block
+    """
+    rows = val.splitlines()[1:]
+    if not rows:
+        raise InputValidationError(
+            "The block '{}' has no rows: its rows must follow a newline, "
+            "e.g. '\\n -8.0 8.0 1000', not {!r}".format(key, val))
+
+    return rows
+
+
+def _write_array_block(infile, bname, array):
+    """
+    Writes a numerical block given as a NumPy array (one row per line)
+    in the Octave text format of the Gollum input.
+    """
+    array = np.atleast_2d(array)
+    if array.ndim != 2:
+        raise InputValidationError("The numerical block '{}' must be a "
+                                   "1D or 2D array".format(bname))
+
+    nrows, ncolumns = array.shape
+    infile.write("# name: {0}\n# type: matrix\n# rows: {1}\n"
+                 "# columns: {2}\n".format(bname, nrows, ncolumns))
+    if array.size:
+        np.savetxt(infile, array, fmt=' ' + ' '.join(['%.12g'] * ncolumns))
 
 
 def _uppercase_dict(d, dict_name):
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+import re
+
+import numpy as np
+
+__copyright__ = u"Copyright (c), 2015, ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE (Theory and Simulation of Materials (THEOS) and National Centre for Computational Design and Discovery of Novel Materials (NCCR MARVEL)), Switzerland and ROBERT BOSCH LLC, USA. All rights reserved."
+__license__ = "MIT license, see LICENSE.txt file"
+__version__ = "0.12.0"
+__contributors__ = "Victor M. Garcia-Suarez"
+
+# Blank lines and lines whose first non-blank character cannot start
+# a number (comments, Octave headers, column titles...)
+_SKIPPED_LINE = re.compile(br'^(?:[ \t]*[^-+.0-9\s][^\n]*|[ \t\r]*)\n', re.M)
+
+# Methods to evaluate the transport curves at the Fermi level
+FERMI_INTERPOLATIONS = ('linear', 'cubic', 'previous')
+
+# Default number of bytes parsed at a time by read_gdat_chunked
+GDAT_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Suffixes of the files compressed on the computer before retrieval
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'xz': '.xz'}
+
+
+def open_gdat(gdat_path):
+    """
+    Opens a Gollum data file for reading, decompressing it on the fly
+    if it ends with one of the COMPRESSION_SUFFIXES.
+    """
+    if gdat_path.endswith(COMPRESSION_SUFFIXES['gzip']):
+        import gzip
+        return gzip.open(gdat_path, 'rb')
+    if gdat_path.endswith(COMPRESSION_SUFFIXES['xz']):
+        try:
+            import lzma
+        except ImportError:
+            try:
+                from backports import lzma
+            except ImportError:
+                raise ImportError("Reading the xz compressed file '{}' "
+                                  "requires the lzma module (backports.lzma "
+                                  "in Python 2)".format(gdat_path))
+        return lzma.open(gdat_path, 'rb')
+
+    return open(gdat_path, 'rb')
+
+
+def is_compressed(gdat_path):
+    """
+    Checks if the name of a Gollum data file has a compression suffix.
+    """
+    return gdat_path.endswith(tuple(COMPRESSION_SUFFIXES.values()))
+
+
+def read_gdat(gdat_path):
+    """
+    Reads a Gollum data file (open channels, transmission...) in a
+    single pass.
+
+    :param gdat_path: path of the .gdat file (optionally compressed)
+
+    Returns two float64 arrays with the first (energy) and the
+    second (open channels, transmission...) columns of the file.
+    """
+    f = open_gdat(gdat_path)
+    try:
+        text = f.read()
+    finally:
+        f.close()
+
+    return parse_gdat(text)
+
+
+def parse_gdat(text):
+    """
+    Parses the content of a Gollum data file, given as a byte string
+    (it is not decoded, to avoid a unicode copy of the whole file).
+
+    The header and comment lines are removed in one regular expression
+    pass and the numerical body is converted by NumPy in C. Files with
+    ragged or malformed rows fall back to a tolerant line by line parse.
+
+    Returns the X and Y float64 arrays.
+    """
+    if not text.endswith(b'\n'):
+        text += b'\n'
+    body = _SKIPPED_LINE.sub('', text)
+
+    nrows = body.count(b'\n')
+    if nrows == 0:
+        return np.empty(0), np.empty(0)
+
+    ncolumns = len(body[:body.index(b'\n')].split())
+    if ncolumns >= 2:
+        values = np.fromstring(body, dtype=float, sep=' ')
+        if values.size == nrows * ncolumns:
+            values = values.reshape(-1, ncolumns)
+            return (np.ascontiguousarray(values[:, 0]),
+                    np.ascontiguousarray(values[:, 1]))
+
+    return _parse_gdat_lines(body.splitlines())
+
+
+def _parse_gdat_lines(lines):
+    """
+    Slow path of parse_gdat. Keeps the lines whose two first fields
+    are numbers.
+    """
+    x = []
+    y = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        try:
+            c1 = float(fields[0])
+            c2 = float(fields[1])
+        except ValueError:
+            continue
+        x.append(c1)
+        y.append(c2)
+
+    return np.array(x, dtype=float), np.array(y, dtype=float)
+
+
+def get_transport_summary(x, y, prefix, fermi_interpolation='linear'):
+    """
+    Computes the summary values of a transport curve: the value and
+    the derivative at the Fermi level, and the maximum and minimum
+    values.
+
+    :param x: energy array (sorted, with the Fermi level at 0)
+    :param y: open channels or transmission array
+    :param prefix: prefix of the keys ('oc', 'tt'...)
+    :param fermi_interpolation: method used to evaluate the curve at
+      the Fermi level (see FERMI_INTERPOLATIONS)
+
+    Returns a dictionary with the keys prefix_ef, prefix_ef_derivative,
+    prefix_M and prefix_m.
+    """
+    value_ef, derivative_ef = evaluate_at_energy(
+        x, y, 0.0, method=fermi_interpolation)
+
+    return {
+        prefix + '_ef': value_ef,
+        prefix + '_ef_derivative': derivative_ef,
+        prefix + '_M': float(y.max()),
+        prefix + '_m': float(y.min()),
+    }
+
+
+def evaluate_at_energy(x, y, energy, method='linear'):
+    """
+    Evaluates a curve and its derivative at an energy. The interval of
+    the grid that contains the energy is found by bisection.
+
+    :param x: energy array (sorted)
+    :param y: open channels or transmission array
+    :param energy: the energy (0 for the Fermi level)
+    :param method: 'linear' (interpolation between the two closest
+      points, or central difference on a point of the grid), 'cubic' (cubic polynomial through the four closest
+      points) or 'previous' (value of the last point below the energy,
+      as in the first versions of the parser, with no derivative)
+
+    Returns the value and the derivative, or 'unknown' for both if the
+    energy is outside the grid.
+    """
+    if method not in FERMI_INTERPOLATIONS:
+        raise ValueError("The interpolation method must be one of {}, not "
+                         "'{}'".format(', '.join(FERMI_INTERPOLATIONS),
+                                       method))
+
+    size = x.size
+    if size < 2 or not x[0] <= energy <= x[-1]:
+        return 'unknown', 'unknown'
+
+    # x[index - 1] <= energy < x[index] (or <= at the end of the grid)
+    index = min(max(int(np.searchsorted(x, energy, side='right')), 1),
+                size - 1)
+
+    if method == 'previous':
+        return float(y[index - 1]), 'unknown'
+
+    if method == 'cubic' and size >= 4:
+        start = min(max(index - 2, 0), size - 4)
+        coefficients = np.polyfit(x[start:start + 4] - energy,
+                                  y[start:start + 4], 3)
+        return float(coefficients[3]), float(coefficients[2])
+
+    # On a point of the grid the derivative is the central difference,
+    # not the forward one, which is biased at the edge of a resonance
+    point = index - 1
+    if x[point] == energy and point > 0:
+        slope = (y[point + 1] - y[point - 1]) / (x[point + 1] - x[point - 1])
+        return float(y[point]), float(slope)
+
+    slope = (y[index] - y[index - 1]) / (x[index] - x[index - 1])
+    value = y[index - 1] + slope * (energy - x[index - 1])
+
+    return float(value), float(slope)
+
+
+def read_summary(summary_path):
+    """
+    Reads the summary written on the computer by the remote reducer
+    (aiida_gollum/utils/gollum_reducer.py).
+
+    :param summary_path: path of the .npz summary file
+
+    Returns a dictionary with the prefix of each reduced file ('oc',
+    'tt'...) as key and a tuple with the decimated X and Y arrays and
+    the dictionary of summary values (see get_transport_summary), with
+    the linear interpolation at the Fermi level, as value.
+    """
+    summaries = {}
+    with np.load(summary_path) as npz:
+        for name in npz.files:
+            if not name.endswith('_summary'):
+                continue
+            prefix = name[:-len('_summary')]
+            ef, derivative, maximum, minimum = npz[name][:4]
+            summaries[prefix] = (
+                np.array(npz[prefix + '_x'], dtype=float),
+                np.array(npz[prefix + '_y'], dtype=float), {
+                    prefix + '_ef': _float_or_unknown(ef),
+                    prefix + '_ef_derivative': _float_or_unknown(derivative),
+                    prefix + '_M': float(maximum),
+                    prefix + '_m': float(minimum),
+                })
+
+    return summaries
+
+
+def _float_or_unknown(value):
+    return 'unknown' if np.isnan(value) else float(value)
+
+
+def read_gdat_chunked(gdat_path, chunk_size=GDAT_CHUNK_SIZE):
+    """
+    Reads a Gollum data file in chunks of about chunk_size bytes,
+    directly into the output arrays. Plain files are read through a
+    memory map and compressed files are decompressed as a stream.
+
+    Only one chunk of text is alive at a time, so the peak memory
+    stays close to the size of the final arrays. The buffers are
+    preallocated from the density of rows of the first chunk and
+    grown if needed.
+
+    :param gdat_path: path of the .gdat file (optionally compressed)
+    :param chunk_size: approximate number of bytes parsed at a time
+
+    Returns the X and Y float64 arrays.
+    """
+    import mmap
+    import os
+
+    if is_compressed(gdat_path):
+        f = open_gdat(gdat_path)
+        try:
+            return _collect_chunks(_iter_stream_chunks(f, chunk_size), None)
+        finally:
+            f.close()
+
+    with open(gdat_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return np.empty(0), np.empty(0)
+
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return _collect_chunks(_iter_mmap_chunks(mm, size, chunk_size),
+                                   size)
+        finally:
+            mm.close()
+
+
+def _iter_mmap_chunks(mm, size, chunk_size):
+    """
+    Yields the text and the number of bytes of the chunks of a memory
+    map. Chunks always end at a newline.
+    """
+    start = 0
+    while start < size:
+        stop = min(start + chunk_size, size)
+        if stop < size:
+            newline = mm.find(b'\n', stop - 1)
+            stop = size if newline < 0 else newline + 1
+        yield mm[start:stop], stop - start
+        start = stop
+
+
+def _iter_stream_chunks(f, chunk_size):
+    """
+    Yields the text and the number of bytes of the chunks of an open
+    (decompressing) file. Chunks always end at a newline.
+    """
+    carry = b''
+    while True:
+        block = f.read(chunk_size)
+        if not block:
+            break
+        block = carry + block
+        end = block.rfind(b'\n') + 1
+        if end == 0:
+            carry = block
+            continue
+        carry = block[end:]
+        yield block[:end], end
+
+    if carry:
+        yield carry, len(carry)
+
+
+def _collect_chunks(chunks, size):
+    """
+    Parses the chunks of a Gollum data file into growing X and Y
+    buffers.
+
+    :param chunks: iterable of (text, number of bytes) tuples
+    :param size: total number of bytes, used to preallocate the
+      buffers (None if it is not known)
+
+    Returns the X and Y float64 arrays.
+    """
+    x = y = None
+    nrows = 0
+    for text, chunk_bytes in chunks:
+        cx, cy = parse_gdat(text)
+        if cx.size == 0:
+            continue
+
+        if x is None:
+            if size is None:
+                capacity = 4 * cx.size
+            else:
+                capacity = int(cx.size * float(size) / chunk_bytes)
+            x = np.empty(max(capacity, cx.size))
+            y = np.empty_like(x)
+        elif nrows + cx.size > x.size:
+            capacity = max(int(x.size * 1.5), nrows + cx.size)
+            x.resize(capacity, refcheck=False)
+            y.resize(capacity, refcheck=False)
+
+        x[nrows:nrows + cx.size] = cx
+        y[nrows:nrows + cx.size] = cy
+        nrows += cx.size
+
+    if x is None:
+        return np.empty(0), np.empty(0)
+
+    x.resize(nrows, refcheck=False)
+    y.resize(nrows, refcheck=False)
+
+    return x, y
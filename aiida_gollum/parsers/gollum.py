@@ -1,9 +1,17 @@
 # -*- coding: utf-8 -*-
+import re
+
 import numpy as np
 from aiida.orm.data.parameter import ParameterData
 from aiida.parsers.parser import Parser
 from aiida.parsers.exceptions import OutputParsingError
-from aiida_gollum.calculations.gollum import GollumCalculation
+from aiida_gollum.calculations.gollum import GollumCalculation, _uppercase_dict
+from aiida_gollum.parsers.gdat import (FERMI_INTERPOLATIONS,
+    COMPRESSION_SUFFIXES, GDAT_CHUNK_SIZE, read_gdat, read_gdat_chunked,
+    read_summary, get_transport_summary)
+from aiida_gollum.utils.thermoelectric import get_thermoelectric_arraydata
+from aiida_gollum.utils.transport import (TRANSPORT_ARRAY_LINKNAME,
+    STORAGE_MODES, set_energy_array, set_curve_array)
 
 __copyright__ = u"Copyright (c), 2015, ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE (Theory and Simulation of Materials (THEOS) and National Centre for Computational Design and Discovery of Novel Materials (NCCR MARVEL)), Switzerland and ROBERT BOSCH LLC, USA. All rights reserved."
 __license__ = "MIT license, see LICENSE.txt file"
@@ -12,6 +20,12 @@ __contributors__ = "Victor M. Garcia-Suarez"
 # Based on the 0.9.0 version of the STM workflow developed by Alberto
 # Garcia for the aiida_siesta plugin
 
+# Markers of the 'aiida.out' lines with relevant information
+_OUTPUT_MARKERS = re.compile('Error|THE END|in =/|Version|LD_LIBRARY_PATH|'
+                             'Start of run|End of run|Elapsed time')
+# Size of the chunks in which 'aiida.out' is read
+_SCAN_CHUNK_SIZE = 4 * 1024 * 1024
+
 class GollumOutputParsingError(OutputParsingError):
      pass
 
@@ -26,77 +40,83 @@ class GollumParser(Parser):
         # check for valid input
         self._check_calc_compatibility(calc)
         super(GollumParser, self).__init__(calc)
+        self._parser_options = {}
 
     def _check_calc_compatibility(self,calc):
         if not isinstance(calc,GollumCalculation):
             raise GollumOutputParsingError("Input calc must be a GollumCalculation")
 
-    def _get_output_nodes(self, output_path, messages_path, oc_path, ou_path, od_path, tt_path, tu_path, td_path):
+    def _get_output_nodes(self, output_path, output_files,
+                          summary_path=None):
         """
-        Extracts output nodes from the standard output and standard error
-        files. (And XML and JSON files)
+        Extracts output nodes from the standard output file and from
+        the output data files.
+
+        :param output_path: path of the 'aiida.out' file (or None)
+        :param output_files: list of (GollumOutput, path) tuples with
+          the output data files that were retrieved
+        :param summary_path: path of the summary of the remote
+          reduction (or None), used for the files that were not
+          retrieved
         """
-        from aiida.orm.data.array.trajectory import TrajectoryData
-        import re
-
         result_list = []
 
-        # Add errors
-        successful = True
-        if messages_path is None:
-            errors_list = ['WARNING: No aiida.out file...']
-        else:
-            successful, errors_list = self.get_errors_from_file(messages_path)
+        # The output data files may be read in the background while
+        # aiida.out is scanned
+        wait_output_data = self._read_output_files(output_files)
 
+        # Add errors, warnings and output data (aiida.out is read once)
+        successful = True
         result_dict = {}
-        result_dict["errors"] = errors_list
-
-        # Add warnings
-        warnings_list = self.get_warnings_from_file(messages_path)
-        result_dict["warnings"] = warnings_list
-
-        # Add outuput data
-        output_dict = self.get_output_from_file(output_path)
-        result_dict.update(output_dict)
-        
-        # Add open channels and transmission data
-        if successful:
-            if oc_path is not None:
-                oc_dict = self.get_ndata_from_file(oc_path,'oc')
-                result_dict.update(oc_dict)
-                oc_data = self.get_transport_data(oc_path)
-                if oc_data is not None:
-                    result_list.append(('oc_array',oc_data))
-            if ou_path is not None:
-                ou_dict = self.get_ndata_from_file(ou_path,'ou')
-                result_dict.update(ou_dict)
-                ou_data = self.get_transport_data(ou_path)
-                if ou_data is not None:
-                    result_list.append(('ou_array',ou_data))
-            if od_path is not None:
-                od_dict = self.get_ndata_from_file(od_path,'od')
-                result_dict.update(od_dict)
-                od_data = self.get_transport_data(od_path)
-                if od_data is not None:
-                    result_list.append(('od_array',od_data))
-            if tt_path is not None:
-                tt_dict = self.get_ndata_from_file(tt_path,'tt')
-                result_dict.update(tt_dict)
-                tt_data = self.get_transport_data(tt_path)
-                if tt_data is not None:
-                    result_list.append(('tt_array',tt_data))
-            if tu_path is not None:
-                tu_dict = self.get_ndata_from_file(tu_path,'tu')
-                result_dict.update(tu_dict)
-                tu_data = self.get_transport_data(tu_path)
-                if tu_data is not None:
-                    result_list.append(('tu_array',tu_data))
-            if td_path is not None:
-                td_dict = self.get_ndata_from_file(td_path,'td')
-                result_dict.update(td_dict)
-                td_data = self.get_transport_data(td_path)
-                if td_data is not None:
-                    result_list.append(('td_array',td_data))
+        if output_path is None:
+            result_dict["errors"] = ['WARNING: No aiida.out file...']
+            result_dict["warnings"] = []
+        else:
+            scan = self.scan_output_file(output_path)
+            successful, errors_list = self._get_errors_from_scan(scan)
+            result_dict["errors"] = errors_list
+            result_dict["warnings"] = scan['warnings']
+            result_dict.update(scan['output'])
+
+        # Add open channels, transmission and other data files, merged
+        # in the order of the registry
+        merge_arrays = self._get_arrays_mode() == 'merged'
+        transport_channels = []
+        transport_curves = {}
+        output_data = wait_output_data(discard=not successful)
+        for (output, path), data in zip(output_files, output_data):
+            if output.filetype == 'gdat':
+                transport_curves[output.prefix] = data
+            if merge_arrays and output.filetype == 'gdat':
+                nd_dict, nd_data = self._get_transport_results(
+                    data, path, output.prefix, arraydata=False)
+                if nd_data is not None:
+                    transport_channels.append((output, data))
+            else:
+                results_function = self._get_results_function(
+                    output.filetype)
+                nd_dict, nd_data = results_function(data, path,
+                                                    output.prefix)
+                if nd_data is not None:
+                    result_list.append((output.linkname, nd_data))
+            result_dict.update(nd_dict)
+
+        if transport_channels:
+            result_list.extend(
+                self._get_merged_transport_nodes(transport_channels))
+
+        # Add the reduced curves of the files that stayed on the computer
+        if summary_path is not None and successful:
+            reduced_nodes, reduced_dict = self._get_reduced_results(
+                summary_path, set(transport_curves))
+            result_list.extend(reduced_nodes)
+            result_dict.update(reduced_dict)
+
+        # Add thermoelectric coefficients, if requested
+        thermoelectric = self._parser_options.get('thermoelectric', None)
+        if thermoelectric is not None and successful:
+            result_list.extend(self._get_thermoelectric_nodes(
+                transport_curves, thermoelectric))
 
         # Add parser info dictionary
         parser_info = {}
@@ -120,43 +140,39 @@ class GollumParser(Parser):
         """
         
         from aiida.common.exceptions import InvalidOperation
-        import os
 
-        output_path = None
-        messages_path  = None
-        oc_path = None
-        ou_path = None
-        od_path = None
-        tt_path = None
-        tu_path = None
-        td_path = None
+        self._parser_options = self._get_parser_options()
+
         try:
-            output_path, messages_path, oc_path, ou_path, od_path, tt_path, tu_path, td_path =\
-                self._fetch_output_files(retrieved)
+            output_path, output_files = self._fetch_output_files(retrieved)
         except InvalidOperation:
             raise
         except IOError as e:
             self.logger.error(e.message)
             return False, ()
 
-        if output_path is None and messages_path is None and oc_path is None and ou_path is None and od_path is None and tt_path is None and tu_path is None and td_path is None:
+        if output_path is None and not output_files:
             self.logger.error("No output files found")
             return False, ()
 
-        successful, out_nodes = self._get_output_nodes(output_path, messages_path, oc_path, ou_path, od_path, tt_path, tu_path, td_path)
+        summary_path = self._fetch_summary_file(retrieved)
+        successful, out_nodes = self._get_output_nodes(
+            output_path, output_files, summary_path=summary_path)
         
         return successful, out_nodes
 
     def _fetch_output_files(self, retrieved):
         """
-        Checks the output folder for standard output and standard error
-        files, returns their absolute paths on success.
+        Checks the output folder for the standard output file and for
+        the output data files of the registry of the calculation.
 
         :param retrieved: A dictionary of retrieved nodes, as obtained from the
           parser.
+
+        Returns the absolute path of the standard output file (None if
+        it is not present) and a list of (GollumOutput, path) tuples
+        with the output data files found, in the order of the registry.
         """
-        from aiida.common.datastructures import calc_states
-        from aiida.common.exceptions import InvalidOperation
         import os
 
         # Check that the retrieved folder is there
@@ -165,174 +181,431 @@ class GollumParser(Parser):
         except KeyError:
             raise IOError("No retrieved folder found")
 
-        list_of_files = out_folder.get_folder_list()
+        folder_path = out_folder.get_abs_path('.')
+        retrieved_files = set(out_folder.get_folder_list())
 
         output_path = None
-        messages_path  = None
-        oc_path = None
-        ou_path = None
-        od_path = None
-        tt_path = None
-        tu_path = None
-        td_path = None
-
-        if self._calc._DEFAULT_OUTPUT_FILE in list_of_files:
-            output_path = os.path.join( out_folder.get_abs_path('.'),
-                                        self._calc._DEFAULT_OUTPUT_FILE )
-        if self._calc._DEFAULT_MESSAGES_FILE in list_of_files:
-            messages_path  = os.path.join( out_folder.get_abs_path('.'),
-                                        self._calc._DEFAULT_MESSAGES_FILE )
-        if self._calc._DEFAULT_OC_FILE in list_of_files:
-            oc_path  = os.path.join( out_folder.get_abs_path('.'),
-                                        self._calc._DEFAULT_OC_FILE )
-        if self._calc._DEFAULT_OU_FILE in list_of_files:
-            ou_path  = os.path.join( out_folder.get_abs_path('.'),
-                                        self._calc._DEFAULT_OU_FILE )
-        if self._calc._DEFAULT_OD_FILE in list_of_files:
-            od_path  = os.path.join( out_folder.get_abs_path('.'),
-                                        self._calc._DEFAULT_OD_FILE )
-        if self._calc._DEFAULT_TT_FILE in list_of_files:
-            tt_path  = os.path.join( out_folder.get_abs_path('.'),
-                                        self._calc._DEFAULT_TT_FILE )
-        if self._calc._DEFAULT_TU_FILE in list_of_files:
-            tu_path  = os.path.join( out_folder.get_abs_path('.'),
-                                        self._calc._DEFAULT_TU_FILE )
-        if self._calc._DEFAULT_TD_FILE in list_of_files:
-            td_path  = os.path.join( out_folder.get_abs_path('.'),
-                                        self._calc._DEFAULT_TD_FILE )
-
-        return output_path, messages_path, oc_path, ou_path, od_path, tt_path, tu_path, td_path
+        if self._calc._DEFAULT_OUTPUT_FILE in retrieved_files:
+            output_path = os.path.join(folder_path,
+                                       self._calc._DEFAULT_OUTPUT_FILE)
+
+        # The data files may have been compressed before the retrieval
+        output_files = []
+        for output in self._calc._GOLLUM_OUTPUTS:
+            for suffix in [''] + sorted(COMPRESSION_SUFFIXES.values()):
+                if output.filename + suffix in retrieved_files:
+                    output_files.append((output, os.path.join(
+                        folder_path, output.filename + suffix)))
+                    break
+
+        return output_path, output_files
+
+    def _fetch_summary_file(self, retrieved):
+        """
+        Returns the absolute path of the summary of the remote
+        reduction, or None if it was not retrieved.
+        """
+        out_folder = retrieved[self._calc._get_linkname_retrieved()]
+        if self._calc._SUMMARY_FILE_NAME in out_folder.get_folder_list():
+            return out_folder.get_abs_path(self._calc._SUMMARY_FILE_NAME)
 
-    def get_errors_from_file(self,messages_path):
+        return None
+
+    def _get_reduced_results(self, summary_path, parsed_prefixes):
         """
-        Generates a list of errors from the 'aiida.out' file.
+        Returns the nodes and the summary values of the curves of the
+        remote reduction whose files were not retrieved. The decimated
+        curves are stored as the full ones, in separate ArrayData with
+        the attribute 'reduced'. They are not used for the
+        thermoelectric coefficients, since the decimation (minimum and
+        maximum of each bucket) does not preserve the integrals.
+
+        :param summary_path: path of the .npz summary
+        :param parsed_prefixes: prefixes of the files already parsed
+        """
+        summaries = read_summary(summary_path)
+
+        nodes = []
+        results = {}
+        for output in self._calc._GOLLUM_OUTPUTS:
+            if (output.prefix in parsed_prefixes or
+                    output.prefix not in summaries):
+                continue
+            x, y, nd_dict = summaries[output.prefix]
+            arraydata = self._get_transport_arraydata(x, y)
+            arraydata._set_attr('reduced', True)
+            nodes.append((output.linkname, arraydata))
+            results.update(nd_dict)
+
+        if nodes:
+            results['reduced'] = True
+
+        return nodes, results
+
+    def scan_output_file(self, output_path, chunk_size=_SCAN_CHUNK_SIZE):
+        """
+        Reads the 'aiida.out' file once, in chunks, and collects the
+        errors, warnings, output variables and termination status.
 
-        :param messages_path: 
+        Only the lines that contain one of the known markers are
+        extracted from each chunk, so the whole file is never held in
+        memory.
+
+        :param output_path: path of the 'aiida.out' file
+        :param chunk_size: number of bytes read at a time
+
+        Returns a dictionary with the keys 'errors', 'warnings',
+        'output' (dictionary of variables), 'normal_end' (boolean)
+        and 'last_lines' (the two last lines of the file).
+        """
+        scan = {
+            'errors': [],
+            'warnings': [],
+            'output': {},
+            'normal_end': False,
+        }
+        previous_line = ''
+        carry = ''
+
+        with open(output_path) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                text = carry + chunk
+                end = text.rfind('\n')
+                if end < 0:
+                    carry = text
+                    continue
+                carry = text[end + 1:]
+                previous_line = text[text.rfind('\n', 0, end) + 1:end]
+
+                pos = 0
+                while True:
+                    match = _OUTPUT_MARKERS.search(text, pos, end)
+                    if match is None:
+                        break
+                    start = text.rfind('\n', 0, match.start()) + 1
+                    pos = text.find('\n', match.end(), end + 1)
+                    _scan_output_line(text[start:pos], scan)
+
+        # The last line may not end with a newline
+        if _OUTPUT_MARKERS.search(carry):
+            _scan_output_line(carry, scan)
+
+        scan['last_lines'] = [previous_line, carry]
+
+        return scan
+
+    def _get_errors_from_scan(self, scan):
+        """
+        Generates the list of errors from the result of
+        scan_output_file.
 
         Returns a boolean indicating success (True) or failure (False)
         and a list of strings.
         """
-        f = open(messages_path)
-        lines = f.read().split('\n')   # There will be a final '' element
-
-        import re
-     
-        # Search for 'Error' messages, log them, and return immediately
-        lineerror = []
-        there_are_fatals = False 
-        for line in lines:
-            if re.match('^.*Error.*$',line):
+        # Log the 'Error' messages and return immediately
+        if scan['errors']:
+            for line in scan['errors']:
                 self.logger.error(line)
-                lineerror.append(line)
-                there_are_fatals = True
-               
-        if there_are_fatals:
-            lineeror.append(lines[-1])
-            return False, lineerror
+            return False, scan['errors'] + scan['last_lines'][-1:]
 
         # Make sure that the job did finish (and was not interrupted
         # externally)
-
-        normal_end = False
-        for line in lines:
-            if re.match('^.*THE END.*$',line):
-                normal_end = True
-               
-        if normal_end == False:
-            lines[-1] = 'FATAL: ABNORMAL_EXTERNAL_TERMINATION'
+        if not scan['normal_end']:
             self.logger.error("Calculation interrupted externally")
-            return False, lines[-2:] # Return also last line of the file
+            # Return also last line of the file
+            return False, [scan['last_lines'][0],
+                           'FATAL: ABNORMAL_EXTERNAL_TERMINATION']
 
-        return True, lineerror
+        return True, []
+
+    def get_errors_from_file(self,messages_path):
+        """
+        Generates a list of errors from the 'aiida.out' file.
+
+        :param messages_path: path of the 'aiida.out' file
+
+        Returns a boolean indicating success (True) or failure (False)
+        and a list of strings.
+        """
+        return self._get_errors_from_scan(
+            self.scan_output_file(messages_path))
 
     def get_warnings_from_file(self,messages_path):
         """
         Generates a list of warnings from the 'aiida.out' file.
 
-        :param messages_path: 
+        :param messages_path: path of the 'aiida.out' file
 
         Returns a list of strings.
         """
-        f = open(messages_path)
-        lines = f.read().split('\n')   # There will be a final '' element
-
-        import re
-
-        # Find warnings
-        linewarning = []
-        for line in lines:
-            if re.match('^.*in =/.*$',line):
-                linewarning.append(line)
-     
-        return linewarning
+        return self.scan_output_file(messages_path)['warnings']
 
     def get_output_from_file(self,output_path):
         """
-        Generates a list of variables from the 'aiida.out' file.
+        Generates a dictionary of variables from the 'aiida.out' file.
 
-        :param output_path: 
+        :param output_path: path of the 'aiida.out' file
 
-        Returns a list of strings.
+        Returns a dictionary.
         """
-        f = open(output_path)
-        lines = f.read().split('\n')   # There will be a final '' element
-
-        import re
-
-        # Find data
-        output_dict = {}
-        for line in lines:
-            if re.match('^.*Version.*$',line):
-                output_dict['gollum_version'] = line.strip()
-            if re.match('^.*LD_LIBRARY_PATH.*$',line):
-                output_dict['ld_library_path'] = line.split()[2]
-            if re.match('^.*Start of run.*$',line):
-                output_dict['start_of_run'] = ' '.join(line.split()[-2:])
-            if re.match('^.*End of run.*$',line):
-                output_dict['end_of_run'] = ' '.join(line.split()[-2:])
-            if re.match('^.*Elapsed time.*$',line):
-                output_dict['total_time'] = float(line.split()[-2])
-     
-        return output_dict
+        return self.scan_output_file(output_path)['output']
 
-    def get_ndata_from_file(self,nd_path,nd_prefix):
+    def _read_output_files(self, output_files):
         """
-        Generates a list of variables from the 'aiida.out' file.
+        Starts reading the output data files and returns a function
+        that waits for their raw contents and returns them in the order
+        of output_files (or an empty list, if called with discard=True).
 
-        :param nd_path: 
+        The files are read sequentially, when the function is called,
+        unless the parser option 'workers' is larger than 1. In that
+        case they are read in the background by a pool of that number
+        of workers, threads or processes according to the parser
+        option 'parallel' ('thread' by default, or 'process').
 
-        Returns a list of strings.
+        :param output_files: list of (GollumOutput, path) tuples
         """
-        f = open(nd_path)
-        lines = f.readlines()
+        options = self._parser_options
+        tasks = [(output.filetype, path, options)
+                 for output, path in output_files]
+
+        workers = min(int(options.get('workers', 1)), len(tasks))
+        if workers <= 1:
+            def read(discard=False):
+                if discard:
+                    return []
+                return [_read_output_file(task) for task in tasks]
+
+            return read
+
+        parallel = options.get('parallel', 'thread')
+        if parallel == 'thread':
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(workers)
+        elif parallel == 'process':
+            from multiprocessing import Pool
+            pool = Pool(workers)
+        else:
+            raise GollumOutputParsingError(
+                "The 'parallel' parser option must be 'thread' or "
+                "'process', not '{}'".format(parallel))
 
-        import re
+        pending = pool.map_async(_read_output_file, tasks)
+        pool.close()
 
-        # Find data
-        nd_dict = {}
-        linenew = []
-        not_ef = True
-        cef = 'unknown'
-        for line in lines:
+        def wait(discard=False):
             try:
-                c1 = float(line.split()[0])
-                c2 = float(line.split()[1])
-                linenew.append(c2)
-                if c1 > 0 and not_ef:
-                    cef=c3
-                    not_ef=False
-                c3=c2 
-            except:
-                pass
-
-        nd_ef = nd_prefix + '_ef'
-        nd_dict[nd_ef] = cef
-        nd_M = nd_prefix + '_M'
-        nd_dict[nd_M] = max(linenew)
-        nd_m = nd_prefix + '_m'
-        nd_dict[nd_m] = min(linenew)
-    
-        return nd_dict
+                output_data = pending.get()
+            finally:
+                pool.join()
+            return [] if discard else output_data
+
+        return wait
+
+    def _get_results_function(self, filetype):
+        """
+        Returns the method that converts the raw content of an output
+        data file of a type of the registry (see GollumOutput) into
+        results. Each method takes the raw content, the path of the
+        file and the prefix of the summary values and returns a
+        dictionary and a node (or None).
+        """
+        results_functions = {
+            'gdat': self._get_transport_results,
+        }
+        try:
+            return results_functions[filetype]
+        except KeyError:
+            raise GollumOutputParsingError(
+                "Unknown type of output file '{}'".format(filetype))
+
+    def _get_transport_results(self, data, nd_path, nd_prefix,
+                               arraydata=True):
+        """
+        Returns the dictionary with the summary values of an open
+        channels or transmission file and the ArrayData with its
+        content (None if the file has no data).
+
+        :param data: tuple with the X and Y arrays read from the file
+        :param nd_path: path of the .gdat file
+        :param nd_prefix: prefix of the summary keys ('oc', 'tt'...)
+        :param arraydata: if False, the data tuple is returned instead
+          of an ArrayData
+        """
+        x, y = data
+        if x.size == 0:
+            self.logger.warning("No data found in {}".format(nd_path))
+            return {}, None
+
+        nd_dict = get_transport_summary(
+            x, y, nd_prefix,
+            fermi_interpolation=self._get_fermi_interpolation())
+        if not arraydata:
+            return nd_dict, data
+
+        return nd_dict, self._get_transport_arraydata(x, y)
+
+    def _get_merged_transport_nodes(self, transport_channels):
+        """
+        Stores all the open channels and transmission curves in a single
+        ArrayData, with the shared energy axis ('energy'), a matrix with
+        a row per curve ('data') and the prefixes of the curves
+        ('channels'). See aiida_gollum.utils.transport for accessors.
+
+        If the energy grids of the files are not identical the curves
+        are stored in separate ArrayData nodes, as in the default mode.
+
+        :param transport_channels: list of (GollumOutput, (X, Y)) tuples
+
+        Returns a list of (link name, node) tuples.
+        """
+        from aiida.orm.data.array import ArrayData
+
+        energy = transport_channels[0][1][0]
+        for output, (x, y) in transport_channels[1:]:
+            if not np.array_equal(x, energy):
+                self.logger.warning(
+                    "The energy grid of {} does not match the one of {}. "
+                    "The transport arrays are stored separately".format(
+                        output.filename, transport_channels[0][0].filename))
+                return [(output.linkname, self._get_transport_arraydata(x, y))
+                        for output, (x, y) in transport_channels]
+
+        storage = self._get_storage_mode()
+        arraydata = ArrayData()
+        set_energy_array(arraydata, 'energy', energy, storage)
+        set_curve_array(arraydata, 'data', np.vstack(
+            [y for output, (x, y) in transport_channels]), storage)
+        arraydata.set_array('channels', np.array(
+            [str(output.prefix) for output, data in transport_channels]))
+
+        return [(self.get_linkname_transport_array(), arraydata)]
+
+    def _get_thermoelectric_nodes(self, transport_curves, thermoelectric):
+        """
+        Computes the thermoelectric coefficients from a transmission
+        curve (see aiida_gollum.utils.thermoelectric).
+
+        :param transport_curves: dictionary with the (X, Y) arrays of
+          each curve, with its prefix as key (only the curves read from
+          the full data files)
+        :param thermoelectric: dictionary of the 'thermoelectric' parser
+          option, with the 'temperatures' and optionally the
+          'chemical_potentials', 'spin_degeneracy',
+          'phonon_thermal_conductance' and the prefix of the
+          transmission curve ('channel', 'tt' by default)
+
+        Returns a list of (link name, node) tuples.
+        """
+        channel = thermoelectric.get('channel', 'tt')
+        try:
+            energy, transmission = transport_curves[channel]
+        except KeyError:
+            self.logger.warning("No full '{}' transmission to compute the "
+                                "thermoelectric coefficients (the curves "
+                                "of the remote reduction are not "
+                                "used)".format(channel))
+            return []
+
+        if energy.size < 2:
+            return []
+
+        try:
+            arraydata = get_thermoelectric_arraydata(energy, transmission,
+                                                     thermoelectric)
+        except ValueError as e:
+            raise GollumOutputParsingError(e.message)
+
+        return [(self.get_linkname_thermoelectric_array(), arraydata)]
+
+    def _get_arrays_mode(self):
+        """
+        Returns the way the transport arrays are stored, given by the
+        parser option 'arrays': 'separate' (default, one ArrayData per
+        file) or 'merged' (one ArrayData for all of them).
+        """
+        arrays_mode = self._parser_options.get('arrays', 'separate')
+        if arrays_mode not in ('separate', 'merged'):
+            raise GollumOutputParsingError(
+                "The 'arrays' parser option must be 'separate' or "
+                "'merged', not '{}'".format(arrays_mode))
+
+        return arrays_mode
+
+    def _get_fermi_interpolation(self):
+        """
+        Returns the method used to evaluate the transport curves at the
+        Fermi level, given by the parser option 'fermi_interpolation':
+        'linear' (default), 'cubic' or 'previous' (see
+        FERMI_INTERPOLATIONS).
+        """
+        method = self._parser_options.get('fermi_interpolation', 'linear')
+        if method not in FERMI_INTERPOLATIONS:
+            raise GollumOutputParsingError(
+                "The 'fermi_interpolation' parser option must be one of "
+                "{}, not '{}'".format(', '.join(FERMI_INTERPOLATIONS),
+                                      method))
+
+        return method
+
+    def _get_storage_mode(self):
+        """
+        Returns the precision with which the transport arrays are
+        stored, given by the parser option 'storage': 'float64'
+        (default), 'float32' or 'compact' (see STORAGE_MODES).
+        """
+        storage = self._parser_options.get('storage', 'float64')
+        if storage not in STORAGE_MODES:
+            raise GollumOutputParsingError(
+                "The 'storage' parser option must be one of {}, not "
+                "'{}'".format(', '.join(STORAGE_MODES), storage))
+
+        return storage
+
+    def _read_gdat(self, nd_path):
+        """
+        Reads a .gdat file with the reader selected in the parser
+        options.
+        """
+        return _read_output_file(('gdat', nd_path, self._parser_options))
+
+    def _get_parser_options(self):
+        """
+        Returns the dictionary of parser options, given under the
+        'parser' key of the settings input node (empty by default).
+        """
+        settings = self._calc.get_inputs_dict().get(
+            self._calc.get_linkname('settings'))
+        if settings is None:
+            return {}
+
+        settings_dict = _uppercase_dict(settings.get_dict(),
+                                        dict_name='settings')
+        parser_options = settings_dict.get('PARSER', {})
+        if not isinstance(parser_options, dict):
+            raise GollumOutputParsingError(
+                "The 'parser' settings must be a dictionary")
+
+        return parser_options
+
+    def get_ndata_from_file(self,nd_path,nd_prefix):
+        """
+        Generates a dictionary with the value at the Fermi level and
+        the maximum and minimum values of an open channels or
+        transmission file.
+
+        :param nd_path: path of the .gdat file
+        :param nd_prefix: prefix of the keys ('oc', 'tt'...)
+
+        Returns a dictionary.
+        """
+        x, y = self._read_gdat(nd_path)
+
+        return get_transport_summary(
+            x, y, nd_prefix,
+            fermi_interpolation=self._get_fermi_interpolation())
 
     def get_linkname_outarray(self):
         """                                                                     
@@ -340,35 +613,86 @@ class GollumParser(Parser):
         """
         return 'output_array'
 
+    def get_linkname_thermoelectric_array(self):
+        """
+        Returns the name of the link to the ArrayData with the
+        thermoelectric coefficients
+        """
+        return 'thermoelectric_array'
+
+    def get_linkname_transport_array(self):
+        """
+        Returns the name of the link to the ArrayData with all the
+        transport curves (when the 'arrays' parser option is 'merged')
+        """
+        return TRANSPORT_ARRAY_LINKNAME
+
     def get_transport_data(self,nd_path):
         """
         Parses the open channels and transmission
         files to get ArrayData objects that can
         be stored in the database
         """
+        x, y = self._read_gdat(nd_path)
+
+        return self._get_transport_arraydata(x, y)
 
-        import numpy as np
+    def _get_transport_arraydata(self, x, y):
+        """
+        Stores the energy (X) and the open channels or transmission (Y)
+        arrays in an ArrayData, with the precision of the storage mode
+        """
         from aiida.orm.data.array import ArrayData
 
-        f = open(nd_path)
-        lines = f.readlines()
+        storage = self._get_storage_mode()
+        arraydata = ArrayData()
+        set_energy_array(arraydata, 'X', x, storage)
+        set_curve_array(arraydata, 'Y', y, storage)
 
-        x = []
-        y = []
-        for line in lines:
-            try:
-                c1 = float(line.split()[0])
-                x.append(c1)
-                c2 = float(line.split()[1])
-                y.append(c2)
-            except:
-                pass
+        return arraydata
 
-        X = np.array(x,dtype=float)
-        Y = np.array(y,dtype=float)
 
-        arraydata = ArrayData()
-        arraydata.set_array('X', X)
-        arraydata.set_array('Y', Y)
+def _read_output_file(task):
+    """
+    Reads an output data file of the registry (see GollumOutput) and
+    returns its raw content. It only depends on its argument, so that
+    it can be run by a pool of threads or processes.
 
-        return arraydata
+    :param task: tuple with the type of the file, its path and the
+      parser options
+    """
+    filetype, path, options = task
+
+    if filetype == 'gdat':
+        if options.get('streaming', False):
+            chunk_size = options.get('chunk_size', GDAT_CHUNK_SIZE)
+            return read_gdat_chunked(path, chunk_size=chunk_size)
+        return read_gdat(path)
+
+    raise GollumOutputParsingError(
+        "Unknown type of output file '{}'".format(filetype))
+
+
+def _scan_output_line(line, scan):
+    """
+    Stores the information of a line of 'aiida.out' in the dictionary
+    filled by GollumParser.scan_output_file
+    """
+    if 'Error' in line:
+        scan['errors'].append(line)
+    if 'THE END' in line:
+        scan['normal_end'] = True
+    if 'in =/' in line:
+        scan['warnings'].append(line)
+
+    output_dict = scan['output']
+    if 'Version' in line:
+        output_dict['gollum_version'] = line.strip()
+    if 'LD_LIBRARY_PATH' in line:
+        output_dict['ld_library_path'] = line.split()[2]
+    if 'Start of run' in line:
+        output_dict['start_of_run'] = ' '.join(line.split()[-2:])
+    if 'End of run' in line:
+        output_dict['end_of_run'] = ' '.join(line.split()[-2:])
+    if 'Elapsed time' in line:
+        output_dict['total_time'] = float(line.split()[-2])
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+import itertools
+import json
+import os
+import time
+import uuid
+
+from aiida.common.datastructures import calc_states
+from aiida.orm.data.parameter import ParameterData
+
+from aiida_gollum.calculations.gollum import get_block_rows
+from aiida_gollum.utils.remote import (get_transport, get_remote_workdir,
+                                       upload_files)
+
+__copyright__ = u"Copyright (c), 2015, ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE (Theory and Simulation of Materials (THEOS) and National Centre for Computational Design and Discovery of Novel Materials (NCCR MARVEL)), Switzerland and ROBERT BOSCH LLC, USA. All rights reserved."
+__license__ = "MIT license, see LICENSE.txt file"
+__version__ = "0.12.0"
+__contributors__ = "Victor M. Garcia-Suarez"
+
+# States in which a calculation does not use the daemon or the
+# scheduler anymore
+FINISHED_STATES = (calc_states.FINISHED, calc_states.FAILED,
+                   calc_states.SUBMISSIONFAILED, calc_states.RETRIEVALFAILED,
+                   calc_states.PARSINGFAILED)
+
+# Folder, inside the working directory of the computer, of the files
+# uploaded once for all the calculations of a batch
+SHARED_FOLDER = 'gollum_shared'
+
+
+class GollumBatch(object):
+    """
+    Builds and submits a parameter sweep of GollumCalculations.
+
+    The calculations share the base parameters and settings, modified
+    at each point of the sweep. Identical parameters and settings are
+    stored only once, and the files shared by all the calculations
+    (typically the leads and the extended molecule) are uploaded once
+    and linked in the working directory of each calculation. For
+    example::
+
+        batch = GollumBatch(code, params_dict, settings_dict,
+                            shared_files=[emname, l1name, l2name])
+        batch.add_sweep('NBlock ERange', ['\n -1.0 1.0 500 ',
+                                          '\n -2.0 2.0 1000 '])
+        batch.add_sweep('NBlock leadp', [leadp_1, leadp_2])
+        batch.submit(max_active=20)
+
+    submits the four combinations of energy windows and leads.
+    """
+
+    def __init__(self, code, parameters, settings=None, shared_files=None,
+                 label='Gollum batch', resources=None,
+                 max_wallclock_seconds=30 * 60, withmpi=False):
+        """
+        :param code: the Gollum code
+        :param parameters: dictionary with the base parameters
+        :param settings: dictionary with the base settings
+        :param shared_files: absolute local paths of the files needed by
+          all the calculations, uploaded once
+        :param label: label of the batch, prefixed to the labels of the
+          calculations
+        :param resources: scheduler resources of each calculation
+        :param max_wallclock_seconds: wallclock limit of each calculation
+        :param withmpi: whether the calculations run with MPI
+        """
+        self.code = code
+        self.parameters = dict(parameters)
+        self.settings = dict(settings or {})
+        self.shared_files = [os.path.abspath(f) for f in shared_files or []]
+        self.label = label
+        self.resources = resources or {"num_machines": 1}
+        self.max_wallclock_seconds = max_wallclock_seconds
+        self.withmpi = withmpi
+
+        self.calculations = []
+        self._sweeps = []
+        self._nodes = {}
+        self._shared_remote_paths = None
+
+    def add_sweep(self, key, values, target='parameters'):
+        """
+        Adds a dimension to the sweep. The points of the batch are all
+        the combinations of the values of the dimensions.
+
+        :param key: key of the parameters (or settings) that changes,
+          or a tuple of keys that change together
+        :param values: list of values of the key, or of tuples of values
+          if several keys are given. The values of the numerical and
+          string blocks are checked to have at least one row
+        :param target: 'parameters' or 'settings'
+        """
+        if target not in ('parameters', 'settings'):
+            raise ValueError("The target of a sweep must be 'parameters' "
+                             "or 'settings', not '{}'".format(target))
+
+        keys = key if isinstance(key, tuple) else (key,)
+        variants = []
+        for value in values:
+            value = value if isinstance(key, tuple) else (value,)
+            if len(value) != len(keys):
+                raise ValueError("Each value of the sweep of {} must have "
+                                 "{} elements".format(keys, len(keys)))
+            for k, v in zip(keys, value):
+                if (target == 'parameters' and k[:6] in ('NBlock', 'SBlock')
+                        and isinstance(v, basestring)):
+                    get_block_rows(k, v)
+            variants.append(dict(zip(keys, value)))
+
+        self._sweeps.append((target, variants))
+
+    def get_points(self):
+        """
+        Returns the list of points of the sweep, each one a dictionary
+        with the 'parameters' and 'settings' that change.
+        """
+        points = []
+        for combination in itertools.product(
+                *[variants for _, variants in self._sweeps]):
+            point = {'parameters': {}, 'settings': {}}
+            for (target, _), variant in zip(self._sweeps, combination):
+                point[target].update(variant)
+            points.append(point)
+
+        return points
+
+    def upload_shared_files(self):
+        """
+        Uploads the shared files to a new folder of the computer of the
+        code (only the first time it is called).
+
+        Returns the list of the absolute remote paths of the files.
+        """
+        if self._shared_remote_paths is None:
+            computer = self.code.get_remote_computer()
+            transport = get_transport(computer)
+            with transport:
+                remote_folder = os.path.join(
+                    get_remote_workdir(computer, transport), SHARED_FOLDER,
+                    uuid.uuid4().hex)
+                self._shared_remote_paths = upload_files(
+                    transport, self.shared_files, remote_folder)
+
+        return self._shared_remote_paths
+
+    def build(self, upload=True):
+        """
+        Creates the (unstored) calculations of all the points of the
+        sweep.
+
+        :param upload: if False the shared files are not uploaded, but
+          copied to each calculation as usual (e.g. for submit_test)
+
+        Returns the list of calculations.
+        """
+        base_settings = dict(self.settings)
+        if self.shared_files:
+            local_copy_list = []
+            for key in list(base_settings):
+                if key.lower() == 'additional_local_copy_list':
+                    local_copy_list += base_settings.pop(key)
+            local_copy_list = [f for f in local_copy_list
+                               if os.path.abspath(f) not in self.shared_files]
+            if upload:
+                base_settings['additional_remote_symlink_list'] = (
+                    self.upload_shared_files())
+            else:
+                local_copy_list += self.shared_files
+            if local_copy_list:
+                base_settings['additional_local_copy_list'] = local_copy_list
+
+        self.calculations = []
+        for index, point in enumerate(self.get_points()):
+            parameters = dict(self.parameters)
+            parameters.update(point['parameters'])
+            settings = dict(base_settings)
+            settings.update(point['settings'])
+
+            calc = self.code.new_calc()
+            calc.label = '{} [{}]'.format(self.label, index)
+            calc.description = json.dumps(point, sort_keys=True)
+            calc.set_max_wallclock_seconds(self.max_wallclock_seconds)
+            calc.set_resources(self.resources)
+            calc.set_withmpi(self.withmpi)
+            calc.use_parameters(self._get_node('parameters', parameters))
+            if settings:
+                calc.use_settings(self._get_node('settings', settings))
+            self.calculations.append(calc)
+
+        return self.calculations
+
+    def submit(self, max_active=50, poll_interval=30, calculations=None):
+        """
+        Stores and submits the calculations, keeping at most max_active
+        of them queued or running at any time.
+
+        When the limit is reached this method waits (sleeping
+        poll_interval seconds between checks) until some calculations
+        finish, so it blocks the caller until the last calculation of
+        the batch has been submitted. With max_active=None all the
+        calculations are submitted at once and it returns immediately.
+
+        :param max_active: largest number of unfinished calculations, or
+          None for no limit
+        :param poll_interval: seconds between checks of the state of
+          the active calculations when the limit is reached
+        :param calculations: the calculations to submit (by default the
+          ones of build, which is called if needed)
+
+        Returns the list of submitted calculations.
+        """
+        if calculations is None:
+            calculations = self.calculations or self.build()
+
+        active = []
+        for calc in calculations:
+            while max_active is not None and len(active) >= max_active:
+                time.sleep(poll_interval)
+                active = [c for c in active
+                          if c.get_state() not in FINISHED_STATES]
+
+            calc.store_all()
+            calc.submit()
+            active.append(calc)
+
+        return calculations
+
+    def _get_node(self, kind, dictionary):
+        """
+        Returns the ParameterData of a dictionary, reusing the node of
+        an identical dictionary of the batch if there is one.
+        """
+        key = (kind, json.dumps(dictionary, sort_keys=True))
+        if key not in self._nodes:
+            self._nodes[key] = ParameterData(dict=dictionary)
+
+        return self._nodes[key]
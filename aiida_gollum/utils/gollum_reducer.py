@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Reduces the output data files of a Gollum run to a compact summary.
+
+This script is copied to the working directory of a GollumCalculation
+and run at the end of the job when the 'remote_reduction' setting is
+given. It only uses the Python standard library (2.7 or 3), so that it
+runs on any cluster, and writes a NumPy .npz file with, for each data
+file, the value and the derivative at the Fermi level, the maximum and
+minimum values and a decimated copy of the curve.
+
+Usage: python gollum_reducer.py OUTPUT POINTS PREFIX=FILE [PREFIX=FILE...]
+"""
+import array
+import struct
+import sys
+import zipfile
+
+__copyright__ = u"Copyright (c), 2015, ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE (Theory and Simulation of Materials (THEOS) and National Centre for Computational Design and Discovery of Novel Materials (NCCR MARVEL)), Switzerland and ROBERT BOSCH LLC, USA. All rights reserved."
+__license__ = "MIT license, see LICENSE.txt file"
+__version__ = "0.12.0"
+__contributors__ = "Victor M. Garcia-Suarez"
+
+
+def read_columns(path):
+    """
+    Returns the first two columns of the numerical lines of a file.
+    """
+    x = array.array('d')
+    y = array.array('d')
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 2:
+                continue
+            try:
+                c1 = float(fields[0])
+                c2 = float(fields[1])
+            except ValueError:
+                continue
+            x.append(c1)
+            y.append(c2)
+
+    return x, y
+
+
+def fermi_value(x, y):
+    """
+    Returns the value and the derivative of the curve at 0, linearly
+    interpolated, or None for both if 0 is outside the grid.
+    """
+    if len(x) < 2 or not x[0] <= 0.0 <= x[-1]:
+        return None, None
+
+    lo, hi = 0, len(x) - 1
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if x[mid] <= 0.0:
+            lo = mid
+        else:
+            hi = mid
+    if x[lo] == 0.0 and lo > 0:
+        return y[lo], (y[lo + 1] - y[lo - 1]) / (x[lo + 1] - x[lo - 1])
+    slope = (y[hi] - y[lo]) / (x[hi] - x[lo])
+
+    return y[lo] - slope * x[lo], slope
+
+
+def decimate(x, y, points):
+    """
+    Keeps about points points of a curve: the minimum and the maximum
+    of each of points / 2 consecutive buckets, so that the peaks of the
+    transmission are preserved.
+    """
+    size = len(x)
+    if size <= points:
+        return x, y
+
+    buckets = max(points // 2, 1)
+    width = -(-size // buckets)
+    rx = array.array('d')
+    ry = array.array('d')
+    for start in range(0, size, width):
+        stop = min(start + width, size)
+        bucket = y[start:stop]
+        imin = start + bucket.index(min(bucket))
+        imax = start + bucket.index(max(bucket))
+        for i in sorted(set((imin, imax))):
+            rx.append(x[i])
+            ry.append(y[i])
+
+    return rx, ry
+
+
+def npy_bytes(values):
+    """
+    Returns the content of a .npy file (format 1.0) with a 1D float64
+    array.
+    """
+    data = array.array('d', values)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    header = "{{'descr': '<f8', 'fortran_order': False, 'shape': ({},), }}" \
+        .format(len(data))
+    padding = 64 - (10 + len(header) + 1) % 64
+    header = header + ' ' * padding + '\n'
+    try:
+        body = data.tobytes()
+    except AttributeError:
+        body = data.tostring()
+
+    return (b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) +
+            header.encode('latin1') + body)
+
+
+def reduce_files(output, points, files):
+    """
+    Writes the summary .npz file of a list of (prefix, path) tuples.
+    Missing files are skipped.
+    """
+    arrays = {}
+    for prefix, path in files:
+        try:
+            x, y = read_columns(path)
+        except IOError:
+            continue
+        if not x:
+            continue
+        ef, derivative = fermi_value(x, y)
+        rx, ry = decimate(x, y, points)
+        arrays[prefix + '_x'] = rx
+        arrays[prefix + '_y'] = ry
+        arrays[prefix + '_summary'] = [
+            float('nan') if ef is None else ef,
+            float('nan') if derivative is None else derivative,
+            max(y), min(y), len(x)]
+
+    archive = zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED)
+    try:
+        for name in sorted(arrays):
+            archive.writestr(name + '.npy', npy_bytes(arrays[name]))
+    finally:
+        archive.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        sys.exit(__doc__)
+    reduce_files(sys.argv[1], int(sys.argv[2]),
+                 [arg.split('=', 1) for arg in sys.argv[3:]])
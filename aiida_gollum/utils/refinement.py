@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from aiida_gollum.utils.sharding import (SHARD_ENERGY_TOLERANCE, SHARD_RTOL,
+                                         SHARD_ATOL)
+
+__copyright__ = u"Copyright (c), 2015, ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE (Theory and Simulation of Materials (THEOS) and National Centre for Computational Design and Discovery of Novel Materials (NCCR MARVEL)), Switzerland and ROBERT BOSCH LLC, USA. All rights reserved."
+__license__ = "MIT license, see LICENSE.txt file"
+__version__ = "0.12.0"
+__contributors__ = "Victor M. Garcia-Suarez"
+
+# Smallest transmission considered by the detection of the resonances,
+# which works with log10(T): the curve is flat below it
+LOG_FLOOR = 1.0e-10
+
+
+def find_refinement_windows(x, y, threshold=0.5, min_spacing=1.0e-4):
+    """
+    Finds the energy windows where a transport curve changes too fast
+    to be resolved by its grid, e.g. around Breit-Wigner and Fano
+    resonances.
+
+    The curve is compared in decades (log10, with the values below
+    LOG_FLOOR clipped): an interval of the grid is refined if the curve
+    changes by more than threshold decades over it, or if the second
+    difference at one of its ends is larger than threshold. Intervals
+    narrower than min_spacing are never refined, so that the refinement
+    of a discontinuity stops.
+
+    :param x: energy array (sorted, maybe non-uniform)
+    :param y: open channels or transmission array
+    :param threshold: largest change (in decades) allowed per interval
+    :param min_spacing: width (in eV) of the narrowest interval refined
+
+    Returns a sorted list of (lowest energy, highest energy) tuples of
+    non-overlapping windows, whose ends are points of the grid.
+    """
+    if x.size < 2:
+        return []
+
+    logy = np.log10(np.maximum(y, LOG_FLOOR))
+    change = np.abs(np.diff(logy))
+
+    # Second differences, with the spacing of the neighbouring
+    # intervals, assigned to both intervals around each point
+    curvature = np.zeros(x.size)
+    if x.size > 2:
+        dx = np.diff(x)
+        slopes = np.diff(logy) / dx
+        curvature[1:-1] = np.abs(np.diff(slopes)) * \
+            0.5 * (dx[:-1] + dx[1:])
+    interval_curvature = np.maximum(curvature[:-1], curvature[1:])
+
+    flagged = (change > threshold) | (interval_curvature > threshold)
+    flagged &= np.diff(x) > min_spacing
+
+    windows = []
+    for i in np.flatnonzero(flagged):
+        if windows and windows[-1][1] == i:
+            windows[-1][1] = i + 1
+        else:
+            windows.append([i, i + 1])
+
+    return [(float(x[start]), float(x[stop])) for start, stop in windows]
+
+
+def merge_curves(curves, rtol=SHARD_RTOL, atol=SHARD_ATOL):
+    """
+    Merges the curves of several runs on different energy grids into a
+    single curve on the union of the grids (usually non-uniform). The
+    energies computed by more than one run must have the same values.
+
+    :param curves: list of (X, Y) tuples
+    :param rtol: relative tolerance of the repeated values
+    :param atol: absolute tolerance of the repeated values
+
+    Returns the sorted X array and the Y array of the merged curve.
+    """
+    x = np.concatenate([xy[0] for xy in curves])
+    y = np.concatenate([xy[1] for xy in curves])
+    order = np.argsort(x, kind='mergesort')
+    x = x[order]
+    y = y[order]
+
+    tolerance = SHARD_ENERGY_TOLERANCE * max(np.abs(x).max(), 1.0)
+    repeated = np.diff(x) <= tolerance
+    if repeated.any():
+        first = np.flatnonzero(repeated)
+        mismatch = ~np.isclose(y[first], y[first + 1], rtol=rtol, atol=atol)
+        if mismatch.any():
+            bad = first[mismatch][0]
+            raise ValueError(
+                "The runs do not match at the energy {}: {} != {}".format(
+                    x[bad], y[bad], y[bad + 1]))
+        keep = np.concatenate([[True], ~repeated])
+        x = x[keep]
+        y = y[keep]
+
+    return x, y
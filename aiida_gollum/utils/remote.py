@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import os
+
+__copyright__ = u"Copyright (c), 2015, ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE (Theory and Simulation of Materials (THEOS) and National Centre for Computational Design and Discovery of Novel Materials (NCCR MARVEL)), Switzerland and ROBERT BOSCH LLC, USA. All rights reserved."
+__license__ = "MIT license, see LICENSE.txt file"
+__version__ = "0.12.0"
+__contributors__ = "Victor M. Garcia-Suarez"
+
+
+def get_transport(computer):
+    """
+    Returns an (unopened) transport to a computer, with the
+    authentication information of the default AiiDA user.
+    """
+    from aiida.backends.utils import get_authinfo, get_automatic_user
+
+    authinfo = get_authinfo(computer=computer,
+                            aiidauser=get_automatic_user())
+
+    return authinfo.get_transport()
+
+
+def get_remote_workdir(computer, transport):
+    """
+    Returns the working directory of a computer, with the remote user
+    name substituted.
+
+    :param computer: the computer
+    :param transport: an open transport to the computer
+    """
+    return computer.get_workdir().format(username=transport.whoami())
+
+
+def upload_files(transport, local_paths, remote_folder):
+    """
+    Copies local files to a remote folder, which is created if needed.
+    The files keep their names.
+
+    :param transport: an open transport
+    :param local_paths: list of absolute local paths
+    :param remote_folder: absolute path of the remote folder
+
+    Returns the list of the absolute remote paths of the files.
+    """
+    transport.makedirs(remote_folder, ignore_existing=True)
+
+    remote_paths = []
+    for local_path in local_paths:
+        remote_path = os.path.join(remote_folder,
+                                   os.path.basename(local_path))
+        transport.put(local_path, remote_path)
+        remote_paths.append(remote_path)
+
+    return remote_paths
+
+
+def fetch_output_files(calc, prefixes=None, folder=None):
+    """
+    Copies output data files of a GollumCalculation from its remote
+    folder, e.g. the full files of a calculation run with the remote
+    reduction, which only retrieves their summary.
+
+    :param calc: a GollumCalculation whose remote folder still exists
+    :param prefixes: prefixes of the files ('oc', 'tt'...), by default
+      all the files of the registry
+    :param folder: local folder where the files are copied (a new
+      temporary folder by default)
+
+    Returns a dictionary with the prefixes of the files found as keys
+    and their local paths (maybe compressed) as values.
+    """
+    import tempfile
+    from aiida_gollum.parsers.gdat import COMPRESSION_SUFFIXES
+
+    remote_folder = calc.get_outputs_dict()['remote_folder']
+    if folder is None:
+        folder = tempfile.mkdtemp()
+    remote_files = set(remote_folder.listdir())
+
+    paths = {}
+    for output in calc._GOLLUM_OUTPUTS:
+        if prefixes is not None and output.prefix not in prefixes:
+            continue
+        for suffix in [''] + sorted(COMPRESSION_SUFFIXES.values()):
+            filename = output.filename + suffix
+            if filename in remote_files:
+                paths[output.prefix] = os.path.join(folder, filename)
+                remote_folder.getfile(filename, paths[output.prefix])
+                break
+
+    return paths
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import time
+import uuid
+
+__copyright__ = u"Copyright (c), 2015, ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE (Theory and Simulation of Materials (THEOS) and National Centre for Computational Design and Discovery of Novel Materials (NCCR MARVEL)), Switzerland and ROBERT BOSCH LLC, USA. All rights reserved."
+__license__ = "MIT license, see LICENSE.txt file"
+__version__ = "0.12.0"
+__contributors__ = "Victor M. Garcia-Suarez"
+
+# Properties of the computer with the absolute path of the cache folder,
+# its largest size in bytes and its index. The files are named after
+# their hash, and the modification time of a file is the time it was
+# last seeded. The index is the list of the hashes found in the folder
+# by the last seed_remote_cache or prune_remote_cache: only the files of
+# the index are linked by the calculations, which are submitted without
+# connecting to the computer
+CACHE_FOLDER_PROPERTY = 'gollum_remote_cache_folder'
+CACHE_MAX_SIZE_PROPERTY = 'gollum_remote_cache_max_size'
+CACHE_INDEX_PROPERTY = 'gollum_remote_cache_index'
+
+DEFAULT_MAX_SIZE = 50 * 1024 ** 3
+
+# Files are only removed from the cache when they have not been seeded
+# for this number of seconds, so that the calculations that link them
+# can finish
+DEFAULT_MIN_AGE = 7 * 24 * 3600
+
+# Suffix of the files being uploaded to the cache folder, which are
+# renamed to their hash once they are complete
+_PARTIAL_SUFFIX = '.part'
+
+_HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Hashes of the local files already hashed, by (path, size, mtime)
+_file_hashes = {}
+
+
+def get_file_hash(path):
+    """
+    Returns the SHA-256 hex digest of a local file. The digest is
+    remembered while the size and modification time of the file do not
+    change, so the large lead files are only read once per process.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if key not in _file_hashes:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+                sha.update(block)
+        _file_hashes[key] = sha.hexdigest()
+
+    return _file_hashes[key]
+
+
+def setup_remote_cache(computer, folder, max_size=DEFAULT_MAX_SIZE):
+    """
+    Creates the cache folder on a computer and enables the cache for
+    the GollumCalculations that run on it. The folder starts with an
+    empty index, the files are added by seed_remote_cache.
+
+    :param computer: a stored computer
+    :param folder: absolute remote path of the cache folder
+    :param max_size: largest total size of the cached files in bytes
+    """
+    from aiida_gollum.utils.remote import get_transport
+
+    if not os.path.isabs(folder):
+        raise ValueError("The remote cache folder must be an absolute path")
+
+    with get_transport(computer) as transport:
+        transport.makedirs(folder, ignore_existing=True)
+
+    computer.set_property(CACHE_FOLDER_PROPERTY, folder)
+    computer.set_property(CACHE_MAX_SIZE_PROPERTY, int(max_size))
+    computer.set_property(CACHE_INDEX_PROPERTY, [])
+
+
+def get_cache_folder(computer):
+    """
+    Returns the cache folder of a computer, or None if the cache is not
+    set up.
+    """
+    return computer.get_property(CACHE_FOLDER_PROPERTY, None)
+
+
+def get_cached_copy_lists(computer, local_copy_list):
+    """
+    Replaces the local copies of a calculation by links to the cache
+    folder of its computer. Only the files of the index of the cache
+    are linked, so no connection to the computer is needed; the other
+    files are left in the local copy list.
+
+    :param computer: the computer of the calculation, with the cache
+      set up by setup_remote_cache
+    :param local_copy_list: list of (local absolute path, relative
+      destination) tuples
+
+    Returns the new local copy list and the remote symlink list, in the
+    format of the CalcInfo.
+    """
+    folder = get_cache_folder(computer)
+    index = set(computer.get_property(CACHE_INDEX_PROPERTY, []))
+
+    new_local_copy_list = []
+    remote_symlink_list = []
+    for local_path, destination in local_copy_list:
+        file_hash = get_file_hash(local_path)
+        if file_hash in index:
+            remote_symlink_list.append(
+                (computer.uuid, os.path.join(folder, file_hash), destination))
+        else:
+            new_local_copy_list.append((local_path, destination))
+
+    return new_local_copy_list, remote_symlink_list
+
+
+def seed_remote_cache(computer, paths, min_age=DEFAULT_MIN_AGE):
+    """
+    Uploads local files to the cache folder of a computer, before the
+    calculations that use them are submitted. The files already cached
+    are marked as recently used instead. Then the least recently used
+    files are removed as by prune_remote_cache, so that the cache stays
+    below its largest size, and the index of the cache is updated.
+
+    :param computer: a computer with the cache set up
+    :param paths: absolute local paths of the files
+    :param min_age: seconds since the last seeding of a removed file
+
+    Returns the list of the paths that could not be uploaded, which are
+    uploaded with each calculation as usual.
+    """
+    from aiida_gollum.utils.remote import get_transport
+
+    folder = get_cache_folder(computer)
+    if folder is None:
+        raise ValueError("The remote cache of the computer {} is not set "
+                         "up".format(computer.name))
+
+    failed = []
+    with get_transport(computer) as transport:
+        cached = set(transport.listdir(folder))
+        for path in paths:
+            file_hash = get_file_hash(path)
+            cached_path = os.path.join(folder, file_hash)
+            try:
+                if file_hash in cached:
+                    _touch(transport, cached_path)
+                else:
+                    _put_cached_file(transport, path, cached_path)
+                    cached.add(file_hash)
+            except (IOError, OSError):
+                failed.append(path)
+
+        _prune(transport, folder, _get_max_size(computer), min_age)
+        _set_index(computer, transport, folder)
+
+    return failed
+
+
+def _touch(transport, path):
+    """
+    Sets the modification time of a cached file to now, which marks it
+    as recently seeded.
+    """
+    from aiida.common.utils import escape_for_bash
+
+    transport.exec_command_wait('touch -c {}'.format(escape_for_bash(path)))
+
+
+def _put_cached_file(transport, local_path, cached_path):
+    """
+    Uploads a file to the cache folder. The file is uploaded with a
+    temporary name and renamed, so that the concurrent calculations
+    only see complete files.
+    """
+    partial_path = '{}.{}{}'.format(cached_path, uuid.uuid4().hex,
+                                    _PARTIAL_SUFFIX)
+    transport.put(local_path, partial_path)
+    transport.rename(partial_path, cached_path)
+
+
+def prune_remote_cache(computer, min_age=DEFAULT_MIN_AGE):
+    """
+    Removes from the cache folder of a computer the least recently
+    seeded files until their total size is below the largest size of
+    the cache, and updates the index of the cache. Only the files that
+    have not been seeded for min_age seconds are removed, as well as the
+    partial uploads of that age, so the cache may stay above its largest
+    size while its files are in use. seed_remote_cache already prunes
+    the cache, this function only needs to be called to shrink it
+    without seeding.
+
+    :param computer: a computer with the cache set up
+    :param min_age: seconds since the last seeding of a removed file
+
+    Returns the list of removed files.
+    """
+    from aiida_gollum.utils.remote import get_transport
+
+    folder = get_cache_folder(computer)
+    if folder is None:
+        return []
+
+    with get_transport(computer) as transport:
+        removed = _prune(transport, folder, _get_max_size(computer), min_age)
+        _set_index(computer, transport, folder)
+
+    return removed
+
+
+def _get_max_size(computer):
+    """
+    Returns the largest size of the cache of a computer in bytes.
+    """
+    return computer.get_property(CACHE_MAX_SIZE_PROPERTY, DEFAULT_MAX_SIZE)
+
+
+def _set_index(computer, transport, folder):
+    """
+    Stores in the index of the cache the complete files of the folder.
+    """
+    computer.set_property(CACHE_INDEX_PROPERTY, sorted(
+        name for name in transport.listdir(folder)
+        if not name.endswith(_PARTIAL_SUFFIX)))
+
+
+def _prune(transport, folder, max_size, min_age):
+    """
+    Removes the least recently seeded files of a cache folder through
+    an open transport (see prune_remote_cache) and returns their names.
+    """
+    limit = time.time() - min_age
+
+    files = []
+    for name in transport.listdir(folder):
+        attributes = transport.get_attribute(os.path.join(folder, name))
+        files.append((attributes.st_mtime, attributes.st_size, name))
+
+    total_size = sum(size for mtime, size, name in files
+                     if not name.endswith(_PARTIAL_SUFFIX))
+    removed = []
+    for mtime, size, name in sorted(files):
+        path = os.path.join(folder, name)
+        if mtime > limit:
+            break
+        if not name.endswith(_PARTIAL_SUFFIX):
+            if total_size <= max_size:
+                continue
+            # The file may have been seeded since it was listed
+            if transport.get_attribute(path).st_mtime > limit:
+                continue
+            total_size -= size
+        transport.remove(path)
+        removed.append(name)
+
+    return removed
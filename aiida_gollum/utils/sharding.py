@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+__copyright__ = u"Copyright (c), 2015, ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE (Theory and Simulation of Materials (THEOS) and National Centre for Computational Design and Discovery of Novel Materials (NCCR MARVEL)), Switzerland and ROBERT BOSCH LLC, USA. All rights reserved."
+__license__ = "MIT license, see LICENSE.txt file"
+__version__ = "0.12.0"
+__contributors__ = "Victor M. Garcia-Suarez"
+
+# Tolerances of the comparison of the point shared by two consecutive
+# shards: relative to the largest energy for the energies, and relative
+# and absolute for the values of the curves (the .gdat files are
+# written with a limited number of digits)
+SHARD_ENERGY_TOLERANCE = 1.0e-6
+SHARD_RTOL = 1.0e-5
+SHARD_ATOL = 1.0e-8
+
+
+def parse_energy_range(val):
+    """
+    Returns the lowest and highest energies and the number of points of
+    the ``NBlock ERange`` block of the Gollum input.
+
+    :param val: the multiline string of the block, e.g. '-8.0 8.0 1000'
+    """
+    fields = val.split()
+    if len(fields) != 3:
+        raise ValueError("The ERange block must have 3 values (lowest "
+                         "energy, highest energy and number of points), "
+                         "not {}".format(len(fields)))
+
+    return float(fields[0]), float(fields[1]), int(fields[2])
+
+
+def format_energy_range(emin, emax, npoints):
+    """
+    Returns the multiline string of the ``NBlock ERange`` block of an
+    energy grid, with the energies written with full precision.
+    """
+    return "\n {!r} {!r} {:d} ".format(float(emin), float(emax), npoints)
+
+
+def split_energy_range(emin, emax, npoints, nshards):
+    """
+    Splits a uniform energy grid into contiguous windows of nearly the
+    same number of points. Consecutive windows share their boundary
+    point, which is used to check that the shards are stitched
+    consistently (see stitch_shards).
+
+    :param emin: lowest energy of the grid
+    :param emax: highest energy of the grid
+    :param npoints: number of points of the grid
+    :param nshards: number of windows
+
+    Returns a list of (lowest energy, highest energy, number of points)
+    tuples, one per window, whose grids are points of the full grid.
+    """
+    if nshards < 1:
+        raise ValueError("The number of shards must be positive, "
+                         "not {}".format(nshards))
+    if npoints < 2 * nshards:
+        raise ValueError("The {} points of the energy grid can not be split "
+                         "in {} shards of at least 2 points".format(
+                             npoints, nshards))
+
+    energy = np.linspace(emin, emax, npoints)
+    bounds = np.linspace(0, npoints - 1, nshards + 1).round().astype(int)
+
+    return [(float(energy[start]), float(energy[stop]), int(stop - start + 1))
+            for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def stitch_shards(curves, rtol=SHARD_RTOL, atol=SHARD_ATOL):
+    """
+    Joins the curves of the windows of a split energy grid into a
+    single curve, checking that consecutive windows agree on their
+    shared point.
+
+    :param curves: list of (X, Y) tuples, one per window, in any order.
+      Y may also be a matrix with a row per curve
+    :param rtol: relative tolerance of the shared values
+    :param atol: absolute tolerance of the shared values
+
+    Returns the X and Y arrays of the whole grid.
+    """
+    curves = sorted(curves, key=lambda xy: xy[0][0])
+
+    xs = [curves[0][0]]
+    ys = [curves[0][1]]
+    for i, (x, y) in enumerate(curves[1:], 1):
+        prev_x, prev_y = curves[i - 1]
+        scale = max(np.abs(prev_x).max(), np.abs(x).max())
+        if abs(prev_x[-1] - x[0]) > SHARD_ENERGY_TOLERANCE * scale:
+            raise ValueError(
+                "The shards {} and {} do not overlap: the first ends at "
+                "{} and the second starts at {}".format(
+                    i - 1, i, prev_x[-1], x[0]))
+        if not np.allclose(prev_y[..., -1], y[..., 0], rtol=rtol, atol=atol):
+            raise ValueError(
+                "The shards {} and {} do not match at their shared energy "
+                "{}: {} != {}".format(i - 1, i, x[0], prev_y[..., -1],
+                                      y[..., 0]))
+        xs.append(x[1:])
+        ys.append(y[..., 1:])
+
+    return np.concatenate(xs), np.concatenate(ys, axis=-1)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+__copyright__ = u"Copyright (c), 2015, ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE (Theory and Simulation of Materials (THEOS) and National Centre for Computational Design and Discovery of Novel Materials (NCCR MARVEL)), Switzerland and ROBERT BOSCH LLC, USA. All rights reserved."
+__license__ = "MIT license, see LICENSE.txt file"
+__version__ = "0.12.0"
+__contributors__ = "Victor M. Garcia-Suarez"
+
+# Physical constants (CODATA 2014)
+BOLTZMANN = 8.6173303e-5           # eV/K
+ELEMENTARY_CHARGE = 1.6021766208e-19  # C
+PLANCK = 6.626070040e-34           # J s
+
+# Largest number of (temperature, chemical potential, energy) points
+# evaluated at once
+_BLOCK_SIZE = 2 ** 24
+
+
+def landauer_moments(energy, transmission, temperatures,
+                     chemical_potentials):
+    """
+    Computes the Landauer moments
+
+        L_n(T, mu) = int dE T(E) (E - mu)^n (-df/dE)
+
+    for n = 0, 1, 2 and all the temperatures and chemical potentials,
+    broadcasting over (temperature, chemical potential, energy). The
+    integrals are done with the trapezoidal rule, so the energy grid
+    does not need to be uniform.
+
+    :param energy: energy grid in eV (sorted)
+    :param transmission: transmission on the energy grid
+    :param temperatures: temperatures in K
+    :param chemical_potentials: chemical potentials in eV
+
+    Returns three arrays (L0 in 1, L1 in eV and L2 in eV^2) of shape
+    (number of temperatures, number of chemical potentials).
+    """
+    energy = np.asarray(energy, dtype=float)
+    transmission = np.asarray(transmission, dtype=float)
+    temperatures = np.atleast_1d(np.asarray(temperatures, dtype=float))
+    mu = np.atleast_1d(np.asarray(chemical_potentials, dtype=float))
+
+    half_step = 0.5 * np.diff(energy)
+    moments = np.empty((3, temperatures.size, mu.size))
+
+    # Blocks of temperatures, to bound the memory of the broadcasting
+    per_temperature = max(mu.size * energy.size, 1)
+    block = max(_BLOCK_SIZE // per_temperature, 1)
+    for start in range(0, temperatures.size, block):
+        kt = BOLTZMANN * temperatures[start:start + block, None, None]
+        de = energy[None, None, :] - mu[None, :, None]
+
+        # -df/dE = 1 / (4 kT cosh^2(de / 2kT)), written with a decaying
+        # exponential to avoid overflows far from mu
+        decay = np.exp(-np.abs(de) / kt)
+        weight = transmission * decay / (kt * (1.0 + decay) ** 2)
+
+        for n in range(3):
+            integrand = weight * de ** n
+            moments[n, start:start + block] = np.sum(
+                (integrand[..., 1:] + integrand[..., :-1]) * half_step,
+                axis=-1)
+
+    return moments[0], moments[1], moments[2]
+
+
+def thermoelectric_coefficients(energy, transmission, temperatures,
+                                chemical_potentials, spin_degeneracy=2,
+                                phonon_thermal_conductance=0.0):
+    """
+    Computes the thermoelectric coefficients of a junction from its
+    transmission, in the linear response regime.
+
+    :param energy: energy grid in eV (sorted)
+    :param transmission: transmission (per spin) on the energy grid
+    :param temperatures: temperatures in K
+    :param chemical_potentials: chemical potentials in eV
+    :param spin_degeneracy: 2 for the transmission per spin of
+      spin-unpolarized calculations, 1 for a single spin channel
+    :param phonon_thermal_conductance: phonon contribution to the
+      thermal conductance in W/K, used in the figure of merit
+
+    Returns a dictionary with the Landauer moments ('L0', 'L1', 'L2'),
+    the electrical conductance in S ('conductance'), the Seebeck
+    coefficient in V/K ('seebeck'), the electronic thermal conductance
+    in W/K ('thermal_conductance') and the figure of merit ('zt'), all
+    of shape (number of temperatures, number of chemical potentials).
+    """
+    temperatures = np.atleast_1d(np.asarray(temperatures, dtype=float))
+    l0, l1, l2 = landauer_moments(energy, transmission, temperatures,
+                                  chemical_potentials)
+
+    t = temperatures[:, None]
+    prefactor = spin_degeneracy * ELEMENTARY_CHARGE ** 2 / PLANCK
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        conductance = prefactor * l0
+        seebeck = -l1 / (t * l0)
+        thermal_conductance = prefactor * (l2 - l1 ** 2 / l0) / t
+        zt = conductance * seebeck ** 2 * t / (
+            thermal_conductance + phonon_thermal_conductance)
+
+    return {
+        'L0': l0,
+        'L1': l1,
+        'L2': l2,
+        'conductance': conductance,
+        'seebeck': seebeck,
+        'thermal_conductance': thermal_conductance,
+        'zt': zt,
+    }
+
+
+def get_thermoelectric_arraydata(energy, transmission, options):
+    """
+    Computes the thermoelectric coefficients and stores them, with the
+    temperatures and chemical potentials, in an ArrayData.
+
+    :param energy: energy grid in eV
+    :param transmission: transmission on the energy grid
+    :param options: dictionary with the 'temperatures' (K) and the
+      optional 'chemical_potentials' (eV, [0.0] by default),
+      'spin_degeneracy' (2) and 'phonon_thermal_conductance' (W/K, 0.0)
+    """
+    from aiida.orm.data.array import ArrayData
+
+    try:
+        temperatures = np.atleast_1d(
+            np.asarray(options['temperatures'], dtype=float))
+    except KeyError:
+        raise ValueError("The temperatures of the thermoelectric "
+                         "coefficients must be given")
+    mu = np.atleast_1d(np.asarray(
+        options.get('chemical_potentials', [0.0]), dtype=float))
+
+    coefficients = thermoelectric_coefficients(
+        energy, transmission, temperatures, mu,
+        spin_degeneracy=options.get('spin_degeneracy', 2),
+        phonon_thermal_conductance=options.get(
+            'phonon_thermal_conductance', 0.0))
+
+    arraydata = ArrayData()
+    arraydata.set_array('temperatures', temperatures)
+    arraydata.set_array('chemical_potentials', mu)
+    for name in sorted(coefficients):
+        arraydata.set_array(name, coefficients[name])
+
+    return arraydata
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from aiida_gollum.calculations.gollum import GOLLUM_OUTPUTS
+
+__copyright__ = u"Copyright (c), 2015, ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE (Theory and Simulation of Materials (THEOS) and National Centre for Computational Design and Discovery of Novel Materials (NCCR MARVEL)), Switzerland and ROBERT BOSCH LLC, USA. All rights reserved."
+__license__ = "MIT license, see LICENSE.txt file"
+__version__ = "0.12.0"
+__contributors__ = "Victor M. Garcia-Suarez"
+
+# Name of the link of the ArrayData with all the transport curves
+TRANSPORT_ARRAY_LINKNAME = 'transport_array'
+
+# Storage modes of the transport arrays: full precision, single
+# precision, and single precision with the uniform energy grids stored
+# as (start, stop, number of points)
+STORAGE_MODES = ('float64', 'float32', 'compact')
+
+# Largest deviation, relative to the largest energy, of a grid stored
+# as (start, stop, number of points)
+GRID_TOLERANCE = 1.0e-6
+
+
+def set_energy_array(arraydata, name, energy, storage='float64'):
+    """
+    Stores an energy grid in an ArrayData with the precision of the
+    storage mode. In 'compact' mode uniform grids are stored as the
+    attribute '<name>_grid', with the first and last energies and the
+    number of points, instead of as an array.
+
+    :param arraydata: an unstored ArrayData
+    :param name: name of the array
+    :param energy: the energy grid
+    :param storage: one of STORAGE_MODES
+    """
+    _check_storage_mode(storage)
+    arraydata._set_attr('storage', storage)
+
+    if storage == 'compact' and _is_uniform_grid(energy):
+        arraydata._set_attr('{}_grid'.format(name),
+                            [float(energy[0]), float(energy[-1]),
+                             int(energy.size)])
+        return
+
+    # Non-uniform grids are not rounded in 'compact' mode
+    if storage == 'float32':
+        energy = energy.astype(np.float32)
+    arraydata.set_array(name, energy)
+
+
+def set_curve_array(arraydata, name, curve, storage='float64'):
+    """
+    Stores a transport curve (or a matrix of curves) in an ArrayData
+    with the precision of the storage mode.
+
+    :param arraydata: an unstored ArrayData
+    :param name: name of the array
+    :param curve: the open channels, transmission... array
+    :param storage: one of STORAGE_MODES
+    """
+    _check_storage_mode(storage)
+    arraydata._set_attr('storage', storage)
+
+    if storage != 'float64':
+        curve = curve.astype(np.float32)
+    arraydata.set_array(name, curve)
+
+
+def get_energy_array(arraydata, name):
+    """
+    Returns an energy grid stored with set_energy_array as a float64
+    array, rebuilding it if it was stored as a uniform grid.
+    """
+    grid = arraydata.get_attr('{}_grid'.format(name), None)
+    if grid is not None:
+        return np.linspace(grid[0], grid[1], int(grid[2]))
+
+    return arraydata.get_array(name).astype(float)
+
+
+def get_curve_array(arraydata, name):
+    """
+    Returns a curve stored with set_curve_array as a float64 array.
+    """
+    return arraydata.get_array(name).astype(float)
+
+
+def _check_storage_mode(storage):
+    if storage not in STORAGE_MODES:
+        raise ValueError("The storage mode must be one of {}, not "
+                         "'{}'".format(', '.join(STORAGE_MODES), storage))
+
+
+def _is_uniform_grid(energy):
+    """
+    Checks if a grid is reproduced by numpy.linspace within
+    GRID_TOLERANCE.
+    """
+    if energy.size < 2:
+        return False
+
+    grid = np.linspace(energy[0], energy[-1], energy.size)
+    tolerance = GRID_TOLERANCE * np.abs(energy).max()
+
+    return bool(np.abs(grid - energy).max() <= tolerance)
+
+
+def get_transport_channels(arraydata):
+    """
+    Splits a merged transport ArrayData (with the 'energy', 'data' and
+    'channels' arrays) into its curves.
+
+    :param arraydata: the ArrayData created by the GollumParser when the
+      'arrays' parser option is 'merged'
+
+    Returns a dictionary with the prefix of each curve ('oc', 'tt'...)
+    as key and a tuple with the X (energy) and Y arrays as value.
+    """
+    energy = get_energy_array(arraydata, 'energy')
+    data = get_curve_array(arraydata, 'data')
+    channels = arraydata.get_array('channels')
+
+    return dict((str(prefix), (energy, data[i]))
+                for i, prefix in enumerate(channels))
+
+
+def get_transport_arrays(calc):
+    """
+    Returns the transport curves of a GollumCalculation, independently
+    of the way the parser stored them (one ArrayData per file or a
+    single merged ArrayData).
+
+    :param calc: a parsed GollumCalculation
+
+    The arrays are restored to float64 whatever their storage mode.
+
+    Returns a dictionary with the name of the link of the ArrayData of
+    each file ('oc_array', 'tt_array'...) as key and a tuple with the
+    X (energy) and Y arrays as value.
+    """
+    outputs = calc.get_outputs_dict()
+    linknames = dict((output.prefix, output.linkname)
+                     for output in GOLLUM_OUTPUTS)
+
+    arrays = {}
+    if TRANSPORT_ARRAY_LINKNAME in outputs:
+        channels = get_transport_channels(outputs[TRANSPORT_ARRAY_LINKNAME])
+        for prefix, xy in channels.items():
+            arrays[linknames.get(prefix, prefix + '_array')] = xy
+
+    for output in GOLLUM_OUTPUTS:
+        if output.linkname in outputs:
+            arraydata = outputs[output.linkname]
+            arrays[output.linkname] = (get_energy_array(arraydata, 'X'),
+                                       get_curve_array(arraydata, 'Y'))
+
+    return arrays
+
+
+def get_full_transport_arrays(calc, prefixes=None):
+    """
+    Returns the full resolution transport curves of a GollumCalculation
+    read from the files in its remote folder, for calculations whose
+    data files were not retrieved (e.g. with the remote reduction).
+
+    :param calc: a GollumCalculation whose remote folder still exists
+    :param prefixes: prefixes of the curves ('oc', 'tt'...), by default
+      all the curves
+
+    Returns a dictionary with the prefixes as keys and tuples with the
+    X (energy) and Y arrays as values.
+    """
+    import shutil
+    import tempfile
+    from aiida_gollum.parsers.gdat import read_gdat
+    from aiida_gollum.utils.remote import fetch_output_files
+
+    folder = tempfile.mkdtemp()
+    try:
+        paths = fetch_output_files(calc, prefixes=prefixes, folder=folder)
+        return dict((prefix, read_gdat(path))
+                    for prefix, path in paths.items())
+    finally:
+        shutil.rmtree(folder)
+
+
+def get_summary_values(calc, prefix='tt'):
+    """
+    Returns the summary values of a transport curve of a
+    GollumCalculation (value at the Fermi level, maximum and minimum)
+    from its output parameters, without loading any array.
+
+    :param calc: a parsed GollumCalculation
+    :param prefix: prefix of the curve ('oc', 'tt'...)
+
+    Returns a dictionary with the keys prefix_ef, prefix_M and prefix_m.
+    """
+    parameters = calc.get_outputs_dict()['output_parameters']
+    keys = ['{}_{}'.format(prefix, suffix) for suffix in ('ef', 'M', 'm')]
+
+    return dict((key, parameters.get_attr(key, None)) for key in keys)
+
+
+def get_transport_window(calc, emin, emax, prefix='tt'):
+    """
+    Returns the part of a transport curve of a GollumCalculation with
+    energies in [emin, emax].
+
+    Only the slice of the stored arrays in the window is read: the
+    arrays of stored nodes are memory-mapped and the window is located
+    by bisection (or directly, for grids stored in 'compact' mode).
+
+    :param calc: a parsed GollumCalculation
+    :param emin: lower energy of the window
+    :param emax: upper energy of the window
+    :param prefix: prefix of the curve ('oc', 'tt'...)
+
+    Returns the X (energy) and Y float64 arrays of the window.
+    """
+    arraydata, energy_name, curve_name, row = _get_curve_location(calc,
+                                                                  prefix)
+    start, stop = _get_window_indices(arraydata, energy_name, emin, emax)
+
+    return _get_index_window(arraydata, energy_name, curve_name, row,
+                             start, stop)
+
+
+def get_transport_value(calc, energy=0.0, prefix='tt'):
+    """
+    Returns the value of a transport curve of a GollumCalculation at a
+    given energy (by default the Fermi level), linearly interpolated
+    between the two closest points of the grid. Only those two points
+    are read from the stored arrays.
+
+    :param calc: a parsed GollumCalculation
+    :param energy: the energy
+    :param prefix: prefix of the curve ('oc', 'tt'...)
+    """
+    arraydata, energy_name, curve_name, row = _get_curve_location(calc,
+                                                                  prefix)
+    grid = arraydata.get_attr('{}_grid'.format(energy_name), None)
+    if grid is not None:
+        size = int(grid[2])
+        step = (grid[1] - grid[0]) / (size - 1)
+        index = int(np.floor((energy - grid[0]) / step))
+    else:
+        x = _open_array(arraydata, energy_name)
+        size = x.shape[0]
+        index = int(np.searchsorted(x, energy)) - 1
+
+    index = min(max(index, 0), size - 2)
+    x, y = _get_index_window(arraydata, energy_name, curve_name, row,
+                             index, index + 2)
+
+    return float(np.interp(energy, x, y))
+
+
+def _get_curve_location(calc, prefix):
+    """
+    Finds where a transport curve of a calculation is stored.
+
+    Returns the ArrayData, the names of its energy and curve arrays and
+    the row of the curve (None if the curve array is one-dimensional).
+    """
+    outputs = calc.get_outputs_dict()
+    linknames = dict((output.prefix, output.linkname)
+                     for output in GOLLUM_OUTPUTS)
+
+    linkname = linknames.get(prefix, prefix + '_array')
+    if linkname in outputs:
+        return outputs[linkname], 'X', 'Y', None
+
+    if TRANSPORT_ARRAY_LINKNAME in outputs:
+        arraydata = outputs[TRANSPORT_ARRAY_LINKNAME]
+        channels = [str(c) for c in arraydata.get_array('channels')]
+        if prefix in channels:
+            return arraydata, 'energy', 'data', channels.index(prefix)
+
+    raise KeyError("The calculation has no '{}' transport curve".format(
+        prefix))
+
+
+def _get_window_indices(arraydata, name, emin, emax):
+    """
+    Returns the first and last + 1 indices of the energies of a stored
+    grid in [emin, emax].
+    """
+    grid = arraydata.get_attr('{}_grid'.format(name), None)
+    if grid is not None:
+        size = int(grid[2])
+        step = (grid[1] - grid[0]) / (size - 1)
+        eps = 1.0e-9
+        start = max(int(np.ceil((emin - grid[0]) / step - eps)), 0)
+        stop = min(int(np.floor((emax - grid[0]) / step + eps)) + 1, size)
+        return start, max(start, stop)
+
+    x = _open_array(arraydata, name)
+    start = int(np.searchsorted(x, emin, side='left'))
+    stop = int(np.searchsorted(x, emax, side='right'))
+
+    return start, stop
+
+
+def _get_index_window(arraydata, energy_name, curve_name, row, start, stop):
+    """
+    Returns the energies and values of a curve between two indices.
+    """
+    grid = arraydata.get_attr('{}_grid'.format(energy_name), None)
+    if grid is not None:
+        step = (grid[1] - grid[0]) / (int(grid[2]) - 1)
+        x = grid[0] + step * np.arange(start, stop)
+    else:
+        x = np.array(_open_array(arraydata, energy_name)[start:stop],
+                     dtype=float)
+
+    curve = _open_array(arraydata, curve_name)
+    if row is None:
+        y = curve[start:stop]
+    else:
+        y = curve[row, start:stop]
+
+    return x, np.array(y, dtype=float)
+
+
+def _open_array(arraydata, name):
+    """
+    Returns an array of an ArrayData. The arrays of stored nodes are
+    memory-mapped from the repository, so that only the slices that
+    are used are read.
+    """
+    if arraydata.is_stored:
+        return np.load(arraydata.get_abs_path('{}.npy'.format(name)),
+                       mmap_mode='r')
+
+    return arraydata.get_array(name)
@@ -5,17 +5,29 @@ from aiida.orm.data.parameter import ParameterData
 from aiida.orm.data.structure import StructureData
 from aiida.orm.data.array.kpoints import KpointsData
 from aiida.orm.data.remote import RemoteData
+from aiida.orm.calculation.job import JobCalculation
 
 from aiida.work.run import submit
-from aiida.work.workchain import WorkChain, ToContext
+from aiida.work.workchain import WorkChain, ToContext, append_, if_
 from aiida.work.workfunction import workfunction
 from aiida.common.links import LinkType
+from aiida.common.datastructures import calc_states
 
 from aiida_siesta.data.psf import get_pseudos_from_structure
 from aiida_siesta.calculations.siesta import SiestaCalculation
 from aiida_siesta.workflows.base import SiestaBaseWorkChain
 
-from aiida_gollum.calculations.gollum import GollumCalculation
+from aiida_gollum.calculations.gollum import GollumCalculation, GOLLUM_OUTPUTS
+from aiida_gollum.parsers.gdat import get_transport_summary
+from aiida_gollum.utils.sharding import (parse_energy_range,
+                                         format_energy_range,
+                                         split_energy_range, stitch_shards)
+from aiida_gollum.utils.transport import (TRANSPORT_ARRAY_LINKNAME,
+                                          get_energy_array, get_curve_array,
+                                          set_energy_array, set_curve_array)
+from aiida_gollum.workflows.leads import (get_lead_hash, find_cached_leads,
+                                          get_remote_folder, register_leads,
+                                          pin_remote_folder)
 
 import os
 
@@ -43,6 +55,11 @@ class GollumSiestaWorkChain(WorkChain):
         spec.input('kpoints_le', valid_type=KpointsData)
         spec.input('kpoints_em', valid_type=KpointsData)
         spec.input('parameters', valid_type=ParameterData)
+        spec.input('use_lead_cache', valid_type=Bool, default=Bool(False))
+        spec.input('pin_leads', valid_type=Bool, default=Bool(False))
+        spec.input('energy_shards', valid_type=Int, default=Int(1))
+        spec.input('remote_folder_le', valid_type=RemoteData, required=False)
+        spec.input('leads_only', valid_type=Bool, default=Bool(False))
         spec.outline(
             cls.setup_siesta_inputs,
             cls.setup_protocol,
@@ -51,13 +68,15 @@ class GollumSiestaWorkChain(WorkChain):
             cls.setup_siesta_parameters,
             cls.setup_basis,
             cls.setup_kpoints,
-            cls.run_leads,
-            cls.run_extmol,
-            cls.setup_gollum_inputs,
-            cls.setup_gollum_settings,
-            cls.setup_gollum_parameters,
-            cls.run_gollum,
-            cls.run_results,
+            cls.run_siesta,
+            cls.inspect_siesta,
+            if_(cls.should_run_gollum)(
+                cls.setup_gollum_inputs,
+                cls.setup_gollum_settings,
+                cls.setup_gollum_parameters,
+                cls.run_gollum,
+                cls.run_results,
+            ),
         )
         spec.dynamic_output()
                                          
@@ -198,61 +217,105 @@ class GollumSiestaWorkChain(WorkChain):
         self.ctx.kpoints_le = self.inputs.kpoints_le
         self.ctx.kpoints_em = self.inputs.kpoints_em
 
-    def run_leads(self):
+    def run_siesta(self):
         """
-        Run the SiestaBaseWorkChain to calculate the extended molecule
-        structure
+        Run the SiestaBaseWorkChains of the leads and the extended
+        molecule at the same time, since they are independent. The
+        next step starts when both have finished. The leads are not
+        run if their remote folder is given (remote_folder_le) or, with
+        use_lead_cache, if a previous workchain ran them with the same
+        inputs and their remote folder still exists. With leads_only,
+        only the leads are run
         """
 
-        self.report('Running run_leads')
+        self.report('Running run_siesta')
+
+        siesta_inputs = self.ctx.siesta_inputs
+        self.ctx.lead_hash = get_lead_hash(
+            self.inputs.siesta_code, self.ctx.structure_le,
+            self.ctx.kpoints_le, siesta_inputs['basis'],
+            self.ctx.protocol['pseudo_familyname'],
+            siesta_inputs['parameters'])
+
+        self.ctx.remote_folder_le = None
+        if 'remote_folder_le' in self.inputs:
+            self.ctx.remote_folder_le = self.inputs.remote_folder_le
+        elif self.inputs.use_lead_cache:
+            self.ctx.remote_folder_le = find_cached_leads(
+                self.ctx.lead_hash,
+                computer=self.inputs.gollum_code.get_remote_computer())
+
+        running = {}
+        if self.ctx.remote_folder_le is None:
+            running['workchain_leads'] = self._submit_siesta(
+                self.ctx.structure_le, self.ctx.kpoints_le)
+            self.report('launched SiestaBaseWorkChain<{}> for the leads'.format(running['workchain_leads'].pid))
+        else:
+            if self.inputs.pin_leads:
+                pin_remote_folder(self.ctx.remote_folder_le)
+            self.report('reusing the leads of RemoteData<{}>'.format(self.ctx.remote_folder_le.pk))
 
-        siesta_inputs = dict(self.ctx.siesta_inputs)
+        if not self.inputs.leads_only:
+            running['workchain_extmol'] = self._submit_siesta(
+                self.ctx.structure_em, self.ctx.kpoints_em)
+            self.report('launched SiestaBaseWorkChain<{}> for the extended molecule'.format(running['workchain_extmol'].pid))
 
-        rle_inputs = {}
-        rle_inputs['code'] = siesta_inputs['siesta_code']
-        rle_inputs['kpoints'] = self.ctx.kpoints_le
-        rle_inputs['basis'] = ParameterData(dict=siesta_inputs['basis'])
-        rle_inputs['structure'] = self.ctx.structure_le
-        rle_inputs['pseudos'] = siesta_inputs['pseudos']
-        rle_inputs['parameters'] = ParameterData(dict=siesta_inputs['parameters'])
-        rle_inputs['settings'] = ParameterData(dict=siesta_inputs['settings'])
-        rle_inputs['clean_workdir'] = Bool(False)
-        rle_inputs['max_iterations'] = Int(20)
-        rle_inputs['options'] = siesta_inputs['options']
-        
-        running = submit(SiestaBaseWorkChain, **rle_inputs)
-
-        self.report('launched SiestaBaseWorkChain<{}> in run-Siesta mode'.format(running.pid))
-        
-        return ToContext(workchain_leads=running)
+        return ToContext(**running)
 
-    def run_extmol(self):
+    def inspect_siesta(self):
         """
-        Run the SiestaBaseWorkChain to calculate the extended molecule
-        structure
+        Report the time taken by each Siesta branch, register the new
+        leads in the cache and return the remote folder of the leads
         """
 
-        self.report('Running run_extmol')
+        branches = []
+        if not self.inputs.leads_only:
+            branches.append(('extended molecule', self.ctx.workchain_extmol))
+        if self.ctx.remote_folder_le is None:
+            branches.insert(0, ('leads', self.ctx.workchain_leads))
+
+        for name, workchain in branches:
+            if get_remote_folder(workchain) is None:
+                self.abort_nowait('SiestaBaseWorkChain<{}> of the {} failed or has no remote folder'.format(
+                    workchain.pk, name))
+                return
+
+        for name, workchain in branches:
+            elapsed = get_elapsed_time(workchain)
+            if elapsed is not None:
+                self.report('SiestaBaseWorkChain<{}> of the {} finished in {:.0f} s'.format(
+                    workchain.pk, name, elapsed))
+
+        if self.ctx.remote_folder_le is None:
+            self.ctx.remote_folder_le = register_leads(
+                self.ctx.workchain_leads, self.ctx.lead_hash,
+                pin=bool(self.inputs.pin_leads))
+
+        self.out('remote_folder_le', self.ctx.remote_folder_le)
+
+    def should_run_gollum(self):
+        return not self.inputs.leads_only
 
+    def _submit_siesta(self, structure, kpoints):
+        """
+        Submit a SiestaBaseWorkChain for a structure and its k-points
+        and return the running process
+        """
         siesta_inputs = dict(self.ctx.siesta_inputs)
 
-        rem_inputs = {}
-        rem_inputs['code'] = siesta_inputs['siesta_code']
-        rem_inputs['kpoints'] = self.ctx.kpoints_em
-        rem_inputs['basis'] = ParameterData(dict=siesta_inputs['basis'])
-        rem_inputs['structure'] = self.ctx.structure_em
-        rem_inputs['pseudos'] = siesta_inputs['pseudos']
-        rem_inputs['parameters'] = ParameterData(dict=siesta_inputs['parameters'])
-        rem_inputs['settings'] = ParameterData(dict=siesta_inputs['settings'])
-        rem_inputs['clean_workdir'] = Bool(False)
-        rem_inputs['max_iterations'] = Int(20)
-        rem_inputs['options'] = siesta_inputs['options']
-        
-        running = submit(SiestaBaseWorkChain, **rem_inputs)
+        inputs = {}
+        inputs['code'] = siesta_inputs['siesta_code']
+        inputs['kpoints'] = kpoints
+        inputs['basis'] = ParameterData(dict=siesta_inputs['basis'])
+        inputs['structure'] = structure
+        inputs['pseudos'] = siesta_inputs['pseudos']
+        inputs['parameters'] = ParameterData(dict=siesta_inputs['parameters'])
+        inputs['settings'] = ParameterData(dict=siesta_inputs['settings'])
+        inputs['clean_workdir'] = Bool(False)
+        inputs['max_iterations'] = Int(20)
+        inputs['options'] = siesta_inputs['options']
 
-        self.report('launched SiestaBaseWorkChain<{}> in run-Siesta mode'.format(running.pid))
-        
-        return ToContext(workchain_extmol=running)
+        return submit(SiestaBaseWorkChain, **inputs)
 
     def setup_gollum_inputs(self):
         """
@@ -306,28 +369,51 @@ class GollumSiestaWorkChain(WorkChain):
 
         ginputs = dict(self.ctx.gollum_inputs)
 
-        # Get the remote folders of previous calculations
-        remote_folder_le = self.ctx.workchain_leads.get_outputs_dict()['remote_folder']
-        lepath = remote_folder_le.get_remote_path()
-        lep = "\n 1 " + lepath + "/aiida.out" + "\n 2 " + lepath + "/aiida.out"
-
+        # The files of the previous calculations are linked in the
+        # 'leads' and 'em' subfolders of the Gollum working directory
+        remote_folder_le = self.ctx.remote_folder_le
         remote_folder_em = self.ctx.workchain_extmol.get_outputs_dict()['remote_folder']
-        empath = remote_folder_em.get_remote_path()
-        emp = empath + "/aiida.out"
 
         ginputs['parameters'].update({
-            'SBlock Path_Leads': lep,
-            'Path_EM': emp,
+            'SBlock Path_Leads': """
+            1 ./leads/aiida.out
+            2 ./leads/aiida.out""",
+            'Path_EM': './em/aiida.out',
+            })
+
+        # The atom block must describe the atoms of the extended molecule
+        ginputs['settings'].update({
+            'expected_atoms': len(self.ctx.structure_em.sites),
             })
 
         gollum_inputs = {}
         gollum_inputs['code'] = ginputs['gollum_code']
-        #gollum_inputs['parent_folder'] = remote_folder
+        gollum_inputs['parent_remote'] = {
+            'leads': remote_folder_le,
+            'em': remote_folder_em,
+            }
         gollum_inputs['settings'] = ParameterData(dict=ginputs['settings'])
         gollum_inputs['parameters'] = ParameterData(dict=ginputs['parameters'])
         gollum_inputs['_options'] = ginputs['options']
 
         process = GollumCalculation.process()
+
+        # The energy grid is split in windows computed at the same time
+        # by independent calculations
+        nshards = self.inputs.energy_shards.value
+        if nshards > 1:
+            windows = split_energy_range(*parse_energy_range(
+                ginputs['parameters']['NBlock ERange']), nshards=nshards)
+            for window in windows:
+                parameters = dict(ginputs['parameters'])
+                parameters['NBlock ERange'] = format_energy_range(*window)
+                gollum_inputs['parameters'] = ParameterData(dict=parameters)
+                running = submit(process, **gollum_inputs)
+                self.report('launching GollumCalculation<{}> for the energies {} to {}'.format(
+                    running.pid, window[0], window[1]))
+                self.to_context(gollum_shards=append_(running))
+            return
+
         running = submit(process, **gollum_inputs)
         
         self.report('launching GollumCalculation<{}>'.format(running.pid))
@@ -339,6 +425,161 @@ class GollumSiestaWorkChain(WorkChain):
         Attach the relevant output nodes from the gollum calculation to the workchain outputs
         for convenience
         """
-        calculation_gollum = self.ctx.gollum_calc
+        if 'gollum_shards' in self.ctx:
+            outputs = self._stitch_gollum_shards()
+            if outputs is None:
+                return
+        else:
+            outputs = self.ctx.gollum_calc.get_outputs_dict()
+
+        linknames = ['output_parameters', TRANSPORT_ARRAY_LINKNAME,
+                     'thermoelectric_array']
+        linknames += [output.linkname for output in GOLLUM_OUTPUTS]
+        for linkname in linknames:
+            if linkname in outputs:
+                self.out(linkname, outputs[linkname])
 
         self.report('workchain succesfully completed'.format())
+
+    def _stitch_gollum_shards(self):
+        """
+        Join the outputs of the Gollum calculations of the energy
+        windows with stitch_gollum_shards and return them, or abort the
+        workchain and return None if one of them failed or if they do
+        not have the same arrays
+        """
+        array_linknames = [TRANSPORT_ARRAY_LINKNAME]
+        array_linknames += [output.linkname for output in GOLLUM_OUTPUTS]
+
+        shards = {}
+        first_arrays = None
+        for i, calc in enumerate(self.ctx.gollum_shards):
+            if calc.get_state() != calc_states.FINISHED:
+                self.abort_nowait('GollumCalculation<{}> of the energy window {} failed with the state {}'.format(
+                    calc.pk, i, calc.get_state()))
+                return None
+
+            outputs = calc.get_outputs_dict()
+            arrays = [linkname for linkname in array_linknames
+                      if linkname in outputs]
+            if 'output_parameters' not in outputs or not arrays:
+                self.abort_nowait('GollumCalculation<{}> of the energy window {} has no results'.format(
+                    calc.pk, i))
+                return None
+            if first_arrays is None:
+                first_arrays = arrays
+            elif arrays != first_arrays:
+                self.abort_nowait('GollumCalculation<{}> of the energy window {} has the arrays {}, not {}'.format(
+                    calc.pk, i, ', '.join(arrays), ', '.join(first_arrays)))
+                return None
+
+            for linkname in ['output_parameters'] + arrays:
+                shards['{}_{}'.format(linkname, i)] = outputs[linkname]
+
+        # The values at the Fermi level are evaluated as in the parser
+        settings = dict((k.lower(), v) for k, v in
+                        self.ctx.gollum_inputs['settings'].items())
+        fermi_interpolation = settings.get('parser', {}).get(
+            'fermi_interpolation', 'linear')
+
+        return stitch_gollum_shards(
+            fermi_interpolation=Str(fermi_interpolation), **shards)
+
+
+def get_elapsed_time(workchain):
+    """
+    Returns the time in seconds from the creation of the first
+    calculation called by a workchain to the creation of the last
+    output of its calculations (when the last one was parsed), or None
+    if it did not call any. The mtime of the workchain is not used,
+    since it also changes when its extras are set.
+    """
+    calcs = workchain.get_outputs(node_type=JobCalculation,
+                                  link_type=LinkType.CALL)
+    if not calcs:
+        return None
+
+    start = min(calc.ctime for calc in calcs)
+    end = max(node.ctime for calc in calcs
+              for node in [calc] + calc.get_outputs(link_type=LinkType.CREATE))
+
+    return (end - start).total_seconds()
+
+
+@workfunction
+def stitch_gollum_shards(fermi_interpolation, **shards):
+    """
+    Joins the outputs of the Gollum calculations of the windows of a
+    split energy grid (see aiida_gollum.utils.sharding).
+
+    :param fermi_interpolation: Str with the method used to evaluate the
+      curves at the Fermi level, the 'fermi_interpolation' parser option
+      of the calculations
+    :param shards: the output nodes of the calculations, with the keys
+      '<link name>_<index of the window>'
+
+    The curves are checked to agree at the energies shared by the
+    windows, and the summary values of the output parameters (value at
+    the Fermi level, maximum and minimum) are computed again from the
+    joined curves. The errors and warnings of all the calculations are
+    kept.
+
+    Returns a dictionary with the joined output_parameters and transport
+    ArrayData nodes, with the link names of the GollumCalculation.
+    """
+    from aiida.orm.data.array import ArrayData
+    from aiida_gollum.utils.transport import get_transport_channels
+
+    method = fermi_interpolation.value
+    nodes = {}
+    for key, node in shards.items():
+        linkname, index = key.rsplit('_', 1)
+        nodes.setdefault(linkname, {})[int(index)] = node
+    parameters = nodes.pop('output_parameters')
+    nshards = len(parameters)
+
+    results = {}
+    result_dict = {'errors': [], 'warnings': []}
+    for index in range(nshards):
+        shard_dict = parameters[index].get_dict()
+        result_dict['errors'].extend(shard_dict.get('errors', []))
+        result_dict['warnings'].extend(shard_dict.get('warnings', []))
+        for key, value in shard_dict.items():
+            result_dict.setdefault(key, value)
+
+    prefixes = dict((output.linkname, output.prefix)
+                    for output in GOLLUM_OUTPUTS)
+    for linkname, arrays in nodes.items():
+        if len(arrays) != nshards:
+            raise ValueError("Only {} of the {} energy windows have the "
+                             "output '{}'".format(len(arrays), nshards,
+                                                  linkname))
+        storage = arrays[0].get_attr('storage', 'float64')
+        arraydata = ArrayData()
+
+        if linkname == TRANSPORT_ARRAY_LINKNAME:
+            channels = arrays[0].get_array('channels')
+            energy, data = stitch_shards(
+                [(get_energy_array(a, 'energy'), get_curve_array(a, 'data'))
+                 for a in arrays.values()])
+            set_energy_array(arraydata, 'energy', energy, storage)
+            set_curve_array(arraydata, 'data', data, storage)
+            arraydata.set_array('channels', channels)
+            for prefix, (x, y) in get_transport_channels(arraydata).items():
+                result_dict.update(get_transport_summary(
+                    x, y, prefix, fermi_interpolation=method))
+        else:
+            x, y = stitch_shards(
+                [(get_energy_array(a, 'X'), get_curve_array(a, 'Y'))
+                 for a in arrays.values()])
+            set_energy_array(arraydata, 'X', x, storage)
+            set_curve_array(arraydata, 'Y', y, storage)
+            result_dict.update(get_transport_summary(
+                x, y, prefixes[linkname], fermi_interpolation=method))
+
+        results[linkname] = arraydata
+
+    result_dict['energy_shards'] = nshards
+    results['output_parameters'] = ParameterData(dict=result_dict)
+
+    return results
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+
+from aiida.orm.calculation.work import WorkCalculation
+from aiida.orm.data.remote import RemoteData
+from aiida.orm.querybuilder import QueryBuilder
+
+__copyright__ = u"Copyright (c), 2015, ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE (Theory and Simulation of Materials (THEOS) and National Centre for Computational Design and Discovery of Novel Materials (NCCR MARVEL)), Switzerland and ROBERT BOSCH LLC, USA. All rights reserved."
+__license__ = "MIT license, see LICENSE.txt file"
+__version__ = "0.12.0"
+__contributors__ = "Victor M. Garcia-Suarez"
+
+# Extra of the SiestaBaseWorkChains of the leads with the hash of their
+# inputs, and extra of the pinned remote folders
+LEAD_HASH_EXTRA = 'gollum_lead_hash'
+PINNED_EXTRA = 'gollum_pinned'
+
+
+def get_lead_hash(code, structure, kpoints, basis, pseudo_family,
+                  parameters):
+    """
+    Returns the hash of the inputs that determine the Siesta
+    calculation of the leads.
+
+    :param code: the Siesta code (different builds of Siesta do not
+      share their leads)
+    :param structure: StructureData of the leads
+    :param kpoints: KpointsData of the leads
+    :param basis: dictionary of the basis
+    :param pseudo_family: name of the pseudopotential family
+    :param parameters: dictionary of the Siesta parameters
+    """
+    content = json.dumps([code.uuid, structure.get_hash(),
+                          kpoints.get_hash(), basis, pseudo_family,
+                          parameters], sort_keys=True)
+
+    return hashlib.sha256(content).hexdigest()
+
+
+def find_cached_leads(lead_hash, computer=None):
+    """
+    Returns the remote folder of the most recent SiestaBaseWorkChain of
+    the leads registered with a hash, or None if there is none or if
+    its folder does not exist anymore on the computer. Only the most
+    recent one is checked, each check opens a connection to the
+    computer.
+
+    :param lead_hash: the hash given by get_lead_hash
+    :param computer: if given, only the remote folders on this computer
+      are considered
+    """
+    remote_filters = {}
+    if computer is not None:
+        remote_filters['dbcomputer_id'] = computer.pk
+
+    qb = QueryBuilder()
+    qb.append(WorkCalculation, tag='leads',
+              filters={'extras.{}'.format(LEAD_HASH_EXTRA): lead_hash})
+    qb.append(RemoteData, output_of='leads',
+              edge_filters={'label': 'remote_folder'},
+              filters=remote_filters, project='*')
+    qb.order_by({'leads': [{'ctime': {'order': 'desc'}}]})
+    qb.limit(1)
+
+    results = qb.all()
+    if not results or not is_remote_folder_available(results[0][0]):
+        return None
+
+    return results[0][0]
+
+
+def is_remote_folder_available(remote_folder):
+    """
+    Checks through a transport that a remote folder still exists and
+    is not empty, since the folders of the cache may be cleaned on the
+    computer (pinning is only advisory).
+    """
+    try:
+        return bool(remote_folder.listdir())
+    except (IOError, OSError):
+        return False
+
+
+def get_remote_folder(workchain):
+    """
+    Returns the 'remote_folder' output of a SiestaBaseWorkChain, or
+    None if the workchain did not finish successfully or has no such
+    output.
+    """
+    if not workchain.has_finished_ok():
+        return None
+
+    return workchain.get_outputs_dict().get('remote_folder', None)
+
+
+def register_leads(workchain, lead_hash, pin=False):
+    """
+    Registers a finished SiestaBaseWorkChain of the leads in the cache,
+    so that the next GollumSiestaWorkChains with the same lead inputs
+    reuse its remote folder.
+
+    :param workchain: the node of the SiestaBaseWorkChain
+    :param lead_hash: the hash given by get_lead_hash
+    :param pin: if True, the remote folder is marked with the extra
+      'gollum_pinned', so that it is kept by clean-up scripts
+
+    Returns the remote folder of the leads, or None (and nothing is
+    registered) if the workchain failed.
+    """
+    remote_folder = get_remote_folder(workchain)
+    if remote_folder is None:
+        return None
+
+    workchain.set_extra(LEAD_HASH_EXTRA, lead_hash)
+    if pin:
+        pin_remote_folder(remote_folder)
+
+    return remote_folder
+
+
+def pin_remote_folder(remote_folder, pinned=True):
+    """
+    Marks (or unmarks) a remote folder as needed by other calculations.
+    """
+    remote_folder.set_extra(PINNED_EXTRA, pinned)
+
+
+def is_pinned(remote_folder):
+    """
+    Checks if a remote folder is pinned. Clean-up scripts should skip
+    the pinned folders.
+    """
+    return bool(remote_folder.get_extra(PINNED_EXTRA, False))
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+from aiida.orm import Code
+from aiida.orm.data.array import ArrayData
+from aiida.orm.data.base import Float, Int, Str
+from aiida.orm.data.parameter import ParameterData
+from aiida.orm.data.remote import RemoteData
+from aiida.common.datastructures import calc_states
+
+from aiida.work.run import submit
+from aiida.work.workchain import WorkChain, while_, append_
+from aiida.work.workfunction import workfunction
+
+from aiida_gollum.calculations.gollum import GollumCalculation, GOLLUM_OUTPUTS
+from aiida_gollum.parsers.gdat import get_transport_summary
+from aiida_gollum.utils.refinement import (find_refinement_windows,
+                                           merge_curves)
+from aiida_gollum.utils.sharding import format_energy_range
+from aiida_gollum.utils.transport import (TRANSPORT_ARRAY_LINKNAME,
+                                          get_energy_array, get_curve_array,
+                                          get_transport_channels,
+                                          set_energy_array, set_curve_array)
+
+__copyright__ = u"Copyright (c), 2015, ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE (Theory and Simulation of Materials (THEOS) and National Centre for Computational Design and Discovery of Novel Materials (NCCR MARVEL)), Switzerland and ROBERT BOSCH LLC, USA. All rights reserved."
+__license__ = "MIT license, see LICENSE.txt file"
+__version__ = "0.12.0"
+__contributors__ = "Victor M. Garcia-Suarez"
+
+
+class GollumRefinementWorkChain(WorkChain):
+    """
+    Adaptive refinement of the energy grid of a transport curve. A
+    GollumCalculation on a coarse grid is followed by calculations on
+    fine grids of the windows where the curve changes too fast (the
+    resonances), until it is resolved, and all the runs are merged in a
+    single curve on a non-uniform grid.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(GollumRefinementWorkChain, self).__init__(*args, **kwargs)
+
+    @classmethod
+    def define(cls, spec):
+        super(GollumRefinementWorkChain, cls).define(spec)
+        spec.input('gollum_code', valid_type=Code)
+        spec.input('parameters', valid_type=ParameterData)
+        spec.input('settings', valid_type=ParameterData, required=False)
+        spec.input('options', valid_type=ParameterData, required=False)
+        spec.input('parent_folder', valid_type=RemoteData, required=False)
+        spec.input('parent_remote_leads', valid_type=RemoteData,
+                   required=False)
+        spec.input('parent_remote_em', valid_type=RemoteData,
+                   required=False)
+        spec.input('channel', valid_type=Str, default=Str('tt'))
+        spec.input('threshold', valid_type=Float, default=Float(0.5))
+        spec.input('min_spacing', valid_type=Float, default=Float(1.0e-4))
+        spec.input('refinement_points', valid_type=Int, default=Int(50))
+        spec.input('max_iterations', valid_type=Int, default=Int(3))
+        spec.outline(
+            cls.setup_gollum_inputs,
+            cls.run_coarse,
+            cls.inspect_runs,
+            while_(cls.should_refine)(
+                cls.run_refinements,
+                cls.inspect_runs,
+            ),
+            cls.run_results,
+        )
+        spec.dynamic_output()
+
+    def setup_gollum_inputs(self):
+        """
+        Setup the inputs shared by all the GollumCalculations
+        """
+
+        self.report('Running setup_gollum_inputs')
+
+        if 'options' in self.inputs:
+            options = self.inputs.options.get_dict()
+        else:
+            options = {
+                'resources': {
+                    'parallel_env': 'mpi',
+                    'tot_num_mpiprocs': 1
+                },
+                'max_wallclock_seconds': 600
+            }
+
+        gollum_inputs = {}
+        gollum_inputs['code'] = self.inputs.gollum_code
+        gollum_inputs['_options'] = options
+        if 'settings' in self.inputs:
+            # The decimated curves of the remote reduction can not be
+            # refined, the full curves are needed
+            settings = self.inputs.settings.get_dict()
+            for key in list(settings):
+                if key.lower() == 'remote_reduction':
+                    del settings[key]
+                    self.report('the remote reduction of the settings is '
+                                'disabled for the refinement')
+            gollum_inputs['settings'] = ParameterData(dict=settings)
+        if 'parent_folder' in self.inputs:
+            gollum_inputs['parent_folder'] = self.inputs.parent_folder
+
+        parent_remote = {}
+        for name in ('leads', 'em'):
+            if 'parent_remote_{}'.format(name) in self.inputs:
+                parent_remote[name] = self.inputs['parent_remote_{}'.format(name)]
+        if parent_remote:
+            gollum_inputs['parent_remote'] = parent_remote
+
+        self.ctx.gollum_inputs = gollum_inputs
+        self.ctx.iteration = 0
+        self.ctx.windows = []
+
+    def run_coarse(self):
+        """
+        Run the GollumCalculation of the energy grid of the parameters
+        """
+
+        self.report('Running run_coarse')
+
+        self.to_context(runs=append_(self._submit_gollum(
+            self.inputs.parameters)))
+
+    def inspect_runs(self):
+        """
+        Merge the curves of the runs and find the windows that are not
+        resolved yet
+        """
+
+        self.report('Running inspect_runs')
+
+        channel = self.inputs.channel.value
+        curves = []
+        for calc in self.ctx.runs:
+            if calc.get_state() != calc_states.FINISHED:
+                self.abort_nowait('GollumCalculation<{}> failed with the state {}'.format(
+                    calc.pk, calc.get_state()))
+                return
+            node = get_channel_node(calc, channel)
+            if node is None:
+                self.abort_nowait('GollumCalculation<{}> has no full {} curve'.format(
+                    calc.pk, channel))
+                return
+            curves.append(get_channel_curve(node, channel))
+
+        x, y = merge_curves(curves)
+        self.ctx.windows = find_refinement_windows(
+            x, y, threshold=self.inputs.threshold.value,
+            min_spacing=self.inputs.min_spacing.value)
+
+        self.report('{} points after {} runs, {} windows to refine'.format(
+            x.size, len(curves), len(self.ctx.windows)))
+
+    def should_refine(self):
+        return (bool(self.ctx.windows) and
+                self.ctx.iteration < self.inputs.max_iterations.value)
+
+    def run_refinements(self):
+        """
+        Run a GollumCalculation on a fine grid for each window, all of
+        them at the same time
+        """
+
+        self.report('Running run_refinements')
+
+        self.ctx.iteration += 1
+        parameters = self.inputs.parameters.get_dict()
+        for emin, emax in self.ctx.windows:
+            parameters['NBlock ERange'] = format_energy_range(
+                emin, emax, self.inputs.refinement_points.value)
+            running = self._submit_gollum(ParameterData(dict=parameters))
+            self.report('launching GollumCalculation<{}> for the energies {} to {}'.format(
+                running.pid, emin, emax))
+            self.to_context(runs=append_(running))
+
+    def run_results(self):
+        """
+        Merge the curves of all the runs in a single ArrayData
+        """
+
+        self.report('Running run_results')
+
+        channel = self.inputs.channel.value
+        nodes = dict(('run_{}'.format(i), get_channel_node(calc, channel))
+                     for i, calc in enumerate(self.ctx.runs))
+
+        results = merge_refined_runs(channel=self.inputs.channel, **nodes)
+        for linkname, node in results.items():
+            self.out(linkname, node)
+
+        if self.ctx.windows:
+            self.report('{} windows were not resolved after {} iterations'.format(
+                len(self.ctx.windows), self.ctx.iteration))
+        self.report('workchain succesfully completed')
+
+    def _submit_gollum(self, parameters):
+        """
+        Submit a GollumCalculation with the shared inputs and the given
+        parameters and return the running process
+        """
+        inputs = dict(self.ctx.gollum_inputs)
+        inputs['parameters'] = parameters
+
+        return submit(GollumCalculation.process(), **inputs)
+
+
+@workfunction
+def merge_refined_runs(channel, **runs):
+    """
+    Merges the curves of the runs of a GollumRefinementWorkChain.
+
+    :param channel: Str with the prefix of the curve ('tt', 'oc'...)
+    :param runs: the ArrayData nodes with the curve of each run (with
+      one curve, or merged with the 'channels' array), with the keys
+      'run_<index>'
+
+    Returns a dictionary with the '<prefix>_array' ArrayData of the
+    merged curve, on a non-uniform grid, and an 'output_parameters'
+    ParameterData with its summary values and the number of runs.
+    """
+    prefix = channel.value
+    x, y = merge_curves([get_channel_curve(node, prefix)
+                         for node in runs.values()])
+
+    arraydata = ArrayData()
+    set_energy_array(arraydata, 'X', x)
+    set_curve_array(arraydata, 'Y', y)
+
+    result_dict = get_transport_summary(x, y, prefix)
+    result_dict['refinement_runs'] = len(runs)
+    result_dict['refinement_points'] = int(x.size)
+
+    return {
+        '{}_array'.format(prefix): arraydata,
+        'output_parameters': ParameterData(dict=result_dict),
+    }
+
+
+def get_channel_node(calc, prefix):
+    """
+    Returns the output ArrayData of a GollumCalculation with a curve,
+    either its own node or the merged transport node, or None if the
+    calculation has no such curve or if it was decimated by the remote
+    reduction.
+
+    :param calc: a parsed GollumCalculation
+    :param prefix: prefix of the curve ('oc', 'tt'...)
+    """
+    outputs = calc.get_outputs_dict()
+    for output in GOLLUM_OUTPUTS:
+        if output.prefix == prefix and output.linkname in outputs:
+            node = outputs[output.linkname]
+            return None if node.get_attr('reduced', False) else node
+
+    merged = outputs.get(TRANSPORT_ARRAY_LINKNAME, None)
+    if (merged is not None and not merged.get_attr('reduced', False) and
+            prefix in merged.get_array('channels')):
+        return merged
+
+    return None
+
+
+def get_channel_curve(arraydata, prefix):
+    """
+    Returns the X (energy) and Y arrays of a curve stored in the node
+    given by get_channel_node.
+    """
+    if 'channels' in arraydata.get_arraynames():
+        return get_transport_channels(arraydata)[prefix]
+
+    return get_energy_array(arraydata, 'X'), get_curve_array(arraydata, 'Y')
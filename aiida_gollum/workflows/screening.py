@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from aiida.orm import Code
+from aiida.orm.data.array import ArrayData
+from aiida.orm.data.base import Bool, Int, Str
+from aiida.orm.data.parameter import ParameterData
+from aiida.orm.data.structure import StructureData
+from aiida.orm.data.array.kpoints import KpointsData
+from aiida.orm.group import Group
+
+from aiida.work.run import submit
+from aiida.work.workchain import WorkChain, ToContext, while_, append_
+from aiida.work.workfunction import workfunction
+
+from aiida_gollum.calculations.gollum import adapt_atom_block
+from aiida_gollum.utils.thermoelectric import ELEMENTARY_CHARGE, PLANCK
+from aiida_gollum.workflows.gollumsiesta import GollumSiestaWorkChain
+
+__copyright__ = u"Copyright (c), 2015, ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE (Theory and Simulation of Materials (THEOS) and National Centre for Computational Design and Discovery of Novel Materials (NCCR MARVEL)), Switzerland and ROBERT BOSCH LLC, USA. All rights reserved."
+__license__ = "MIT license, see LICENSE.txt file"
+__version__ = "0.12.0"
+__contributors__ = "Victor M. Garcia-Suarez"
+
+# Conductance quantum (S) of a spin-degenerate channel, 2e^2/h
+CONDUCTANCE_QUANTUM = 2 * ELEMENTARY_CHARGE ** 2 / PLANCK
+
+
+class GollumScreeningWorkChain(WorkChain):
+    """
+    Screening of many junctions with the same leads. The leads are
+    calculated once, and then the extended molecule and the Gollum
+    calculation of each extended molecule of a group are run by a
+    GollumSiestaWorkChain, at most max_concurrent at a time. T(Ef) and
+    the conductance of all the junctions are collected in a table.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(GollumScreeningWorkChain, self).__init__(*args, **kwargs)
+
+    @classmethod
+    def define(cls, spec):
+        super(GollumScreeningWorkChain, cls).define(spec)
+        spec.input('siesta_code', valid_type=Code)
+        spec.input('gollum_code', valid_type=Code)
+        spec.input('structure_le', valid_type=StructureData)
+        spec.input('structures_em', valid_type=Str)
+        spec.input('protocol', valid_type=Str, default=Str('standard'))
+        spec.input('kpoints_le', valid_type=KpointsData)
+        spec.input('kpoints_em', valid_type=KpointsData)
+        spec.input('parameters', valid_type=ParameterData)
+        spec.input('max_concurrent', valid_type=Int, default=Int(10))
+        spec.input('pin_leads', valid_type=Bool, default=Bool(False))
+        spec.outline(
+            cls.setup_junctions,
+            cls.run_leads,
+            cls.inspect_leads,
+            while_(cls.has_pending_junctions)(
+                cls.run_junctions,
+            ),
+            cls.run_summary,
+        )
+        spec.dynamic_output()
+
+    def setup_junctions(self):
+        """
+        Get the extended molecules from the group given by its name
+        """
+
+        self.report('Running setup_junctions')
+
+        group = Group.get_from_string(self.inputs.structures_em.value)
+        structures = [node for node in group.nodes
+                      if isinstance(node, StructureData)]
+        if not structures:
+            self.abort_nowait('The group {} has no structures'.format(
+                self.inputs.structures_em.value))
+            return
+
+        self.ctx.structures_em = sorted(structures, key=lambda n: n.pk)
+        self.ctx.next_junction = 0
+
+    def run_leads(self):
+        """
+        Run only the Siesta calculation of the leads, with a leads_only
+        GollumSiestaWorkChain (the pseudopotentials and the mesh cutoff
+        are those of the first extended molecule)
+        """
+
+        self.report('Running run_leads')
+
+        running = submit(GollumSiestaWorkChain,
+                         leads_only=Bool(True),
+                         **self._get_junction_inputs(self.ctx.structures_em[0]))
+
+        self.report('launched GollumSiestaWorkChain<{}> for the leads'.format(
+            running.pid))
+
+        return ToContext(workchain_leads=running)
+
+    def inspect_leads(self):
+        """
+        Get the remote folder of the leads, shared by all the junctions
+        """
+
+        self.report('Running inspect_leads')
+
+        outputs = self.ctx.workchain_leads.get_outputs_dict()
+        if 'remote_folder_le' not in outputs:
+            self.abort_nowait('GollumSiestaWorkChain<{}> of the leads has no remote folder'.format(
+                self.ctx.workchain_leads.pk))
+            return
+
+        self.ctx.remote_folder_le = outputs['remote_folder_le']
+
+    def has_pending_junctions(self):
+        return self.ctx.next_junction < len(self.ctx.structures_em)
+
+    def run_junctions(self):
+        """
+        Run the next max_concurrent junctions. The next batch starts
+        when all of them have finished
+        """
+
+        self.report('Running run_junctions')
+
+        for _ in range(self.inputs.max_concurrent.value):
+            if not self.has_pending_junctions():
+                break
+            self.to_context(junctions=append_(self._submit_junction()))
+
+    def run_summary(self):
+        """
+        Collect the transmission at the Fermi level and the conductance
+        of all the junctions in a single ArrayData
+        """
+
+        self.report('Running run_summary')
+
+        results = {}
+        for structure, workchain in zip(self.ctx.structures_em,
+                                        self.ctx.junctions):
+            outputs = workchain.get_outputs_dict()
+            if 'output_parameters' in outputs:
+                results['junction_{}'.format(structure.pk)] = \
+                    outputs['output_parameters']
+            else:
+                self.report('GollumSiestaWorkChain<{}> of StructureData<{}> has no results'.format(
+                    workchain.pk, structure.pk))
+
+        summary = summarize_screening(**results)
+        self.out('screening_summary', summary['screening_summary'])
+
+        self.report('screened {} junctions'.format(len(results)))
+
+    def _submit_junction(self):
+        """
+        Submit the GollumSiestaWorkChain of the extended molecule and
+        the Gollum calculation of the next junction, with the leads
+        already calculated
+        """
+        structure = self.ctx.structures_em[self.ctx.next_junction]
+        self.ctx.next_junction += 1
+
+        running = submit(GollumSiestaWorkChain,
+                         remote_folder_le=self.ctx.remote_folder_le,
+                         **self._get_junction_inputs(structure))
+
+        self.report('launched GollumSiestaWorkChain<{}> for StructureData<{}>'.format(
+            running.pid, structure.pk))
+
+        return running
+
+    def _get_junction_inputs(self, structure):
+        """
+        Return the inputs of the GollumSiestaWorkChain of an extended
+        molecule, with the atom block adapted to its number of atoms
+        """
+        parameters = self.inputs.parameters.get_dict()
+        if 'atom' in parameters:
+            parameters['atom'] = adapt_atom_block(parameters['atom'],
+                                                  len(structure.sites))
+
+        return {
+            'siesta_code': self.inputs.siesta_code,
+            'gollum_code': self.inputs.gollum_code,
+            'structure_le': self.inputs.structure_le,
+            'structure_em': structure,
+            'protocol': self.inputs.protocol,
+            'kpoints_le': self.inputs.kpoints_le,
+            'kpoints_em': self.inputs.kpoints_em,
+            'parameters': ParameterData(dict=parameters),
+            'pin_leads': self.inputs.pin_leads,
+        }
+
+
+@workfunction
+def summarize_screening(**output_parameters):
+    """
+    Collects the results of the junctions of a screening in a table.
+
+    :param output_parameters: the 'output_parameters' of the Gollum
+      calculation of each junction, with the keys 'junction_<pk>',
+      where pk is the pk of the structure of the extended molecule
+
+    Returns an ArrayData with the arrays 'structures' (pks of the
+    extended molecules), 'tt_ef' (transmission at the Fermi level, NaN
+    if unknown) and 'conductance' (S).
+    """
+    keys = sorted(output_parameters, key=lambda k: int(k.split('_')[1]))
+
+    structures = np.array([int(k.split('_')[1]) for k in keys], dtype=int)
+    tt_ef = np.array([_float_or_nan(output_parameters[k].get_attr('tt_ef',
+                                                                  None))
+                      for k in keys], dtype=float)
+
+    summary = ArrayData()
+    summary.set_array('structures', structures)
+    summary.set_array('tt_ef', tt_ef)
+    summary.set_array('conductance', CONDUCTANCE_QUANTUM * tt_ef)
+
+    return {'screening_summary': summary}
+
+
+def _float_or_nan(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
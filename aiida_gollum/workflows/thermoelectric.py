@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from aiida.work.workfunction import workfunction
+
+from aiida_gollum.utils.thermoelectric import get_thermoelectric_arraydata
+from aiida_gollum.utils.transport import (get_transport_channels,
+    get_energy_array, get_curve_array)
+
+__copyright__ = u"Copyright (c), 2015, ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE (Theory and Simulation of Materials (THEOS) and National Centre for Computational Design and Discovery of Novel Materials (NCCR MARVEL)), Switzerland and ROBERT BOSCH LLC, USA. All rights reserved."
+__license__ = "MIT license, see LICENSE.txt file"
+__version__ = "0.12.0"
+__contributors__ = "Victor M. Garcia-Suarez"
+
+
+@workfunction
+def compute_thermoelectric(transport, parameters):
+    """
+    Computes the conductance, Seebeck coefficient, electronic thermal
+    conductance and figure of merit of a junction from the transmission
+    parsed from a GollumCalculation, for several temperatures and
+    chemical potentials.
+
+    :param transport: the 'tt_array' (or 'tu_array', 'td_array') output
+      of a GollumCalculation, or its 'transport_array' output if the
+      arrays were merged, not decimated by the remote reduction
+    :param parameters: ParameterData with the 'temperatures' (K) and
+      the optional 'chemical_potentials' (eV), 'spin_degeneracy',
+      'phonon_thermal_conductance' (W/K) and 'channel' (prefix of the
+      curve of a merged 'transport_array', 'tt' by default)
+    """
+    options = parameters.get_dict()
+
+    if transport.get_attr('reduced', False):
+        raise ValueError("The curve of ArrayData<{}> was decimated by the "
+                         "remote reduction, the thermoelectric coefficients "
+                         "need the full curve".format(transport.pk))
+
+    if 'channels' in transport.get_arraynames():
+        channel = options.get('channel', 'tt')
+        energy, transmission = get_transport_channels(transport)[channel]
+    else:
+        energy = get_energy_array(transport, 'X')
+        transmission = get_curve_array(transport, 'Y')
+
+    thermoelectric_array = get_thermoelectric_arraydata(
+        energy, transmission, options)
+
+    return {'thermoelectric_array': thermoelectric_array}